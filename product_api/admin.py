@@ -1,13 +1,106 @@
+"""admin of the product models, for tables of any size: each page runs a bounded count of queries
+
+    - changelists load FK targets by list_select_related (no query per row) and never count the whole table
+      (CappedCountPaginator, show_full_result_count = False)
+    - FK's are edited by autocomplete widgets, ManyToMany's of catalogs by raw id's (thousands of products),
+      so no form loads all rows of the related table
+    - a numeric search term is an exact match of the id fields (primary key, indexed FK's), other terms are searched
+      as prefixes (^) of the names
+"""
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
 
 from . import models
 
+COUNT_LIMIT = 10000   # rows counted by the changelists; more rows can be reached by search or filters only
+
+
+class CappedCountPaginator(Paginator):
+    """counts at most COUNT_LIMIT rows (SELECT COUNT(*) FROM (.. LIMIT ..)), so the cost doesn't grow with the table"""
+    @cached_property
+    def count(self):
+        return self.object_list[:COUNT_LIMIT].count()
+
+
+class ProductApiAdmin(admin.ModelAdmin):
+    paginator = CappedCountPaginator
+    show_full_result_count = False   # no COUNT(*) of the whole table
+    list_per_page = 100
+    ordering = ['pk']   # also of autocomplete results, which are paginated (the models have no Meta.ordering)
+    search_id_fields = ['id']   # fields matched exactly by numeric search terms
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if term.isdigit():
+            condition = Q()
+            for field in self.search_id_fields:
+                condition |= Q(**{field: int(term)})
+            return queryset.filter(condition), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+@admin.register(models.AttributeName)
+class AttributeNameAdmin(ProductApiAdmin):
+    list_display = ['id', 'nazev', 'kod', 'zobrazit']
+    list_filter = ['zobrazit']
+    search_fields = ['^nazev', '^kod']
+
+
+@admin.register(models.AttributeValue)
+class AttributeValueAdmin(ProductApiAdmin):
+    list_display = ['id', 'hodnota']
+    search_fields = ['^hodnota']
+
+
+@admin.register(models.Attribute)
+class AttributeAdmin(ProductApiAdmin):
+    list_display = ['id', 'nazev_atributu_id', 'hodnota_atributu_id']
+    list_select_related = ['nazev_atributu_id', 'hodnota_atributu_id']
+    search_fields = ['^nazev_atributu_id__nazev', '^hodnota_atributu_id__hodnota']
+    search_id_fields = ['id', 'nazev_atributu_id', 'hodnota_atributu_id']
+    autocomplete_fields = ['nazev_atributu_id', 'hodnota_atributu_id']
+
+    def get_queryset(self, request):   # also for autocomplete results, Attribute.__str__ shows the name and the value
+        return super().get_queryset(request).select_related('nazev_atributu_id', 'hodnota_atributu_id')
+
+
+@admin.register(models.Product)
+class ProductAdmin(ProductApiAdmin):
+    list_display = ['id', 'nazev', 'cena', 'mena', 'is_published', 'published_on']
+    list_filter = ['is_published', 'mena']
+    search_fields = ['^nazev']
+
+
+@admin.register(models.ProductAttributes)
+class ProductAttributesAdmin(ProductApiAdmin):
+    list_display = ['id', 'product', 'attribute']
+    list_select_related = ['product', 'attribute__nazev_atributu_id', 'attribute__hodnota_atributu_id']
+    search_fields = ['^product__nazev']
+    search_id_fields = ['id', 'product', 'attribute']   # composite indexes (product, attribute) and (attribute, product)
+    autocomplete_fields = ['product', 'attribute']
+
+
+@admin.register(models.Image)
+class ImageAdmin(ProductApiAdmin):
+    list_display = ['id', 'nazev', 'obrazek']
+    search_fields = ['^nazev']
+
+
+@admin.register(models.ProductImage)
+class ProductImageAdmin(ProductApiAdmin):
+    list_display = ['id', 'nazev', 'product', 'obrazek_id']
+    list_select_related = ['product', 'obrazek_id']
+    search_fields = ['^nazev']
+    search_id_fields = ['id', 'product', 'obrazek_id']
+    autocomplete_fields = ['product', 'obrazek_id']
+
 
-admin.site.register(models.AttributeName)
-admin.site.register(models.AttributeValue)
-admin.site.register(models.Attribute)
-admin.site.register(models.Product)
-admin.site.register(models.ProductAttributes)
-admin.site.register(models.Image)
-admin.site.register(models.ProductImage)
-admin.site.register(models.Catalog)
+@admin.register(models.Catalog)
+class CatalogAdmin(ProductApiAdmin):
+    list_display = ['id', 'nazev', 'obrazek_id']
+    list_select_related = ['obrazek_id']
+    search_fields = ['^nazev']
+    autocomplete_fields = ['obrazek_id']
+    raw_id_fields = ['products_ids', 'attributes_ids']   # pk's only: catalogs have too much products for select widgets
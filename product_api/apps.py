@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class ProductApiConfig(AppConfig):
     name = 'product_api'
+
+    def ready(self):
+        from . import cache, changes, db, facets, fingerprints, signals  # noqa: F401 (receivers of signals.rows_changed, connection_created)
+        from .importer import MODELSWITCH
+        from .readers import compile_readers
+        signals.connect(Model for Model, _Serializer, _import_order in MODELSWITCH.values())
+        compile_readers()
@@ -0,0 +1,217 @@
+"""benchmarks of the API: synthetic feeds and timed scenarios, see: python manage.py benchmark --help
+
+    generate(items, ..) : feed in the format of test_data.json ([{"Model": {"id": .., ..}}]) with about `items` items;
+        the same arguments (and seed) give the same feed, revision=N changes texts, prices and catalog products
+    Benchmark(..).run() : runs the scenarios through the Django test client (in an empty test database, see the command)
+        and returns the report: throughput, SQL queries (see metrics.py) and peak memory (tracemalloc) of each scenario
+"""
+import json
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+
+from . import metrics
+from .cache import get_cache
+from .models import Attribute, Product, ProductAttributes
+
+ATTRIBUTE_NAMES = 10     # AttributeName rows, each with ATTRIBUTE_VALUES // ATTRIBUTE_NAMES values
+ATTRIBUTE_VALUES = 100   # AttributeValue rows; Attribute rows are all (name, value) pairs of them
+CURRENCIES = ('CZK', 'EUR')
+
+
+def generate(items=1000, attributes=3, catalogs=10, catalog_size=100, revision=0, seed=0):
+    """feed of about `items` items: dictionaries of attributes + products, each with `attributes` ProductAttributes,
+    an Image and a ProductImage + `catalogs` catalogs, each with `catalog_size` products and `attributes` attributes
+    """
+    rng = random.Random(seed)   # only for the structure (links), which doesn't change with the revision
+    mark = ' (%s)' % revision if revision else ''
+    values_per_name = ATTRIBUTE_VALUES // ATTRIBUTE_NAMES
+    attribute_count = ATTRIBUTE_NAMES * values_per_name
+    products = max(1, (items - ATTRIBUTE_NAMES - ATTRIBUTE_VALUES - attribute_count - catalogs) // (3 + attributes))
+
+    feed = []
+    for pk in range(1, ATTRIBUTE_NAMES + 1):
+        feed.append({'AttributeName': {'id': pk, 'nazev': 'name %s%s' % (pk, mark), 'kod': 'code%s' % pk}})
+    for pk in range(1, ATTRIBUTE_VALUES + 1):
+        feed.append({'AttributeValue': {'id': pk, 'hodnota': 'value %s%s' % (pk, mark)}})
+    for pk in range(1, attribute_count + 1):
+        name = (pk - 1) // values_per_name + 1
+        feed.append({'Attribute': {'id': pk, 'nazev_atributu_id': name, 'hodnota_atributu_id': pk}})
+    for pk in range(1, products + 1):
+        feed.append({'Product': {
+            'id': pk, 'nazev': 'product %s%s' % (pk, mark), 'description': 'description of the product %s%s' % (pk, mark),
+            'cena': '%s.%02d' % (pk % 10000 + revision, pk % 100), 'mena': CURRENCIES[pk % len(CURRENCIES)],
+            'published_on': '2018-01-%02dT10:00:00Z' % (pk % 28 + 1) if pk % 2 else None, 'is_published': bool(pk % 2)}})
+    pk = 0
+    for product in range(1, products + 1):
+        for attribute in rng.sample(range(1, attribute_count + 1), min(attributes, attribute_count)):
+            pk += 1
+            feed.append({'ProductAttributes': {'id': pk, 'attribute': attribute, 'product': product}})
+    for pk in range(1, products + 1):
+        feed.append({'Image': {'id': pk, 'nazev': 'image %s%s' % (pk, mark), 'obrazek': 'https://images.example.com/%s.jpg' % pk}})
+    for pk in range(1, products + 1):
+        feed.append({'ProductImage': {'id': pk, 'product': pk, 'obrazek_id': pk, 'nazev': 'photo %s%s' % (pk, mark)}})
+    feed.extend(generate_catalogs(products, catalogs, catalog_size, attributes, revision, seed))
+    return feed
+
+
+def generate_catalogs(products, catalogs=10, catalog_size=100, attributes=3, revision=0, seed=0):
+    """Catalog items of the feed; each revision replaces half of the products of each catalog"""
+    rng = random.Random(seed)
+    attribute_count = ATTRIBUTE_NAMES * (ATTRIBUTE_VALUES // ATTRIBUTE_NAMES)
+    size = min(catalog_size, products)
+    feed = []
+    for pk in range(1, catalogs + 1):
+        start = (pk * size + revision * (size // 2 or 1)) % products
+        feed.append({'Catalog': {
+            'id': pk, 'nazev': 'catalog %s%s' % (pk, ' (%s)' % revision if revision else ''), 'obrazek_id': pk % products + 1,
+            'products_ids': sorted({(start + i) % products + 1 for i in range(size)}),
+            'attributes_ids': sorted(rng.sample(range(1, attribute_count + 1), min(attributes, attribute_count)))}})
+    return feed
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Benchmark:
+    """scenarios of the report, in this order (each one works with the data of the previous ones):
+        import_insert : POST /import of the feed into empty tables
+        import_update : the feed with all texts and prices changed (revision 1)
+        import_noop : the same payload again (answered from ImportDigest)
+        import_unchanged : the same items in a different payload (other formatting), rows are skipped by fingerprints
+        catalog_update : Catalog items only, half of the products of each catalog replaced (ManyToMany)
+        list : GET /detail/product/ (all id's)
+        list_pages : all pages of ?after=..&limit=1000
+        list_batch : ?ids=.. by 100 id's
+        detail : GET /detail/product/<pk> with an empty cache
+        detail_cached : the same requests again
+        lookup_.. : queries of the indexes of models.py (`requests` times with random parameters), with the plan of the query
+    """
+    def __init__(self, items=1000, attributes=3, catalogs=10, catalog_size=100, requests=1000, seed=0, memory=True, log=None):
+        self.options = OrderedDict([('items', items), ('attributes', attributes), ('catalogs', catalogs),
+                                    ('catalog_size', catalog_size), ('requests', requests), ('seed', seed)])
+        self.memory = memory   # tracemalloc slows the code down (~2x), so the times are comparable only with the same setting
+        self.log = log or (lambda msg: None)
+        self.client = Client()
+        self.scenarios = []
+
+    def measure(self, name, count, func, plan=None):
+        """run func() (returns list of responses), add the result into the report"""
+        self.log(name)
+        if self.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with metrics.collect() as collector:
+            responses = func()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if self.memory else None
+        if self.memory:
+            tracemalloc.stop()
+        statuses = sorted({response.status_code for response in responses})
+        self.scenarios.append(OrderedDict([
+            ('name', name), ('count', count), ('requests', len(responses)), ('seconds', round(seconds, 4)),
+            ('per_second', round(count / seconds, 1) if seconds else None), ('queries', collector.queries),
+            ('db_seconds', round(collector.db_time, 4)), ('peak_memory_kb', None if peak is None else peak // 1024),
+            ('status', statuses)]))
+        if plan is not None:
+            self.scenarios[-1]['plan'] = plan
+        errors = [response for response in responses if response.status_code >= 400]
+        if errors:
+            self.scenarios[-1]['errors'] = errors[0].content.decode()[:1000]
+
+    def post(self, payload):
+        return [self.client.post('/import', payload, content_type='application/json')]
+
+    def run(self):
+        options = self.options
+        feed = generate(options['items'], options['attributes'], options['catalogs'], options['catalog_size'], seed=options['seed'])
+        products = sum(1 for item in feed if 'Product' in item)
+        count = len(feed)
+        insert = json.dumps(feed).encode()
+        del feed
+        self.measure('import_insert', count, lambda: self.post(insert))
+        del insert
+
+        update = generate(options['items'], options['attributes'], options['catalogs'], options['catalog_size'], revision=1, seed=options['seed'])
+        payload = json.dumps(update).encode()
+        self.measure('import_update', count, lambda: self.post(payload))
+        self.measure('import_noop', count, lambda: self.post(payload))
+        payload = json.dumps(update, indent=1).encode()   # other bytes, the same items
+        del update
+        self.measure('import_unchanged', count, lambda: self.post(payload))
+        del payload
+
+        catalogs = generate_catalogs(products, options['catalogs'], options['catalog_size'], options['attributes'], revision=2, seed=options['seed'])
+        payload = json.dumps(catalogs).encode()
+        links = sum(len(item['Catalog']['products_ids']) + len(item['Catalog']['attributes_ids']) for item in catalogs)
+        self.measure('catalog_update', links, lambda: self.post(payload))
+
+        get = self.client.get
+        self.measure('list', products, lambda: [get('/detail/product/')])
+        self.measure('list_pages', products, lambda: self.pages('/detail/product/?limit=1000'))
+        pks = random.Random(options['seed']).sample(range(1, products + 1), min(options['requests'], products))
+        batches = [pks[i:i + 100] for i in range(0, len(pks), 100)]
+        self.measure('list_batch', len(pks), lambda: [get('/detail/product/', {'ids': ','.join(map(str, batch))}) for batch in batches])
+        get_cache().clear()
+        self.measure('detail', len(pks), lambda: [get('/detail/product/%s' % pk) for pk in pks])
+        self.measure('detail_cached', len(pks), lambda: [get('/detail/product/%s' % pk) for pk in pks])
+
+        for name, query in self.lookups(products).items():
+            self.measure(name, options['requests'], lambda: self.repeat(query), plan=query().explain())
+        return self.report()
+
+    def repeat(self, query):
+        for _i in range(self.options['requests']):
+            list(query())
+        return []   # no responses
+
+    def lookups(self, products):
+        """{name: function returning the query}, the queries which should use the indexes of models.py"""
+        rng = random.Random(self.options['seed'])
+        attribute = lambda: rng.randint(1, ATTRIBUTE_NAMES * (ATTRIBUTE_VALUES // ATTRIBUTE_NAMES))
+        return OrderedDict([
+            # products with the attribute (facets.py), ProductAttributes (attribute, product)
+            ('lookup_attribute_products', lambda: ProductAttributes.objects.filter(attribute_id=attribute()).values_list('product_id', flat=True)),
+            # attributes of the product (documents.py), unique ProductAttributes (product, attribute)
+            ('lookup_product_attributes', lambda: ProductAttributes.objects.filter(product_id=rng.randint(1, products)).values_list('attribute_id', flat=True)),
+            # products of the catalog with the attribute
+            ('lookup_catalog_attribute', lambda: Product.objects.filter(
+                catalogs=rng.randint(1, max(1, self.options['catalogs'])), productattributes__attribute=attribute()).values_list('pk', flat=True)),
+            # deduplication of attributes, unique Attribute (name, value)
+            ('lookup_attribute_pair', lambda: Attribute.objects.filter(
+                nazev_atributu_id=rng.randint(1, ATTRIBUTE_NAMES), hodnota_atributu_id=rng.randint(1, ATTRIBUTE_VALUES)).values_list('pk', flat=True)),
+            # latest published products, Product (is_published, published_on)
+            ('lookup_published', lambda: Product.objects.filter(is_published=True).order_by('-published_on').values_list('pk', flat=True)[:100]),
+        ])
+
+    def pages(self, url):
+        responses = []
+        while url:
+            responses.append(self.client.get(url))
+            link = responses[-1].get('Link')
+            url = link[1:link.index('>')] if link else None
+        return responses
+
+    def report(self):
+        return OrderedDict([
+            ('commit', git_commit()),
+            ('python', platform.python_version()),
+            ('django', django.get_version()),
+            ('database', connection.vendor),
+            ('tracemalloc', self.memory),
+            ('options', self.options),
+            ('scenarios', self.scenarios),
+        ])
@@ -0,0 +1,150 @@
+"""read-through cache of Detail responses: {(model name, pk): (stamp, serializer data)}
+
+The backend is set in settings.DETAIL_CACHE = {'BACKEND': 'dotted.path.Class', 'OPTIONS': {..}}, BACKEND None disables the cache:
+    LRUCache : local memory of the process (default), OPTIONS: max_size, ttl, verify
+    DjangoCache : any cache from settings.CACHES (memcached, ..), shared by all processes, OPTIONS: alias, ttl
+Entries of changed rows are deleted by signals.rows_changed (immediately and once more after commit of the transaction).
+Each entry is stored with the stamp of its row: (seq, modified) of the row's last change (Change.stamps, also the ETag),
+read before the row, so staleness is per row:
+    - a shared backend gets the invalidations of all processes, its entries are served without any query; an entry stored
+      by a Detail which read the row before a commit (after the invalidation) is checked once more and deleted (set_rows)
+    - LRUCache gets the invalidations of its process only, so (verify=True) the stamps of its entries are compared with
+      Change (1 query by the unique index); verify=False serves them without any query, if a single process writes and reads
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Change
+from .signals import rows_changed
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class LRUCache:
+    """least recently used entries are removed if there is more than max_size entries, entries expire after ttl seconds"""
+    def __init__(self, max_size=10000, ttl=3600, verify=True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.verify = verify   # entries can be stale if other processes change the rows, see get_rows
+        self.entries = OrderedDict()   # {key: (expires, value)}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DjangoCache:
+    """entries stored in a cache of django.core.cache"""
+    verify = False   # shared by all processes, so it gets all invalidations
+
+    def __init__(self, alias='default', ttl=3600):
+        self.alias = alias
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(key):
+        return 'detail:%s:%s' % key
+
+    def get(self, key):
+        return caches[self.alias].get(self.make_key(key))
+
+    def set(self, key, value):
+        caches[self.alias].set(self.make_key(key), value, self.ttl)
+
+    def delete_many(self, keys):
+        caches[self.alias].delete_many([self.make_key(key) for key in keys])
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+class NoCache:
+    verify = True   # nothing is stored, nothing to check once more after storing
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete_many(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = settings.DETAIL_CACHE
+            if config.get('BACKEND'):
+                _cache = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+            else:
+                _cache = NoCache()
+    return _cache
+
+
+def get_rows(model, pks):
+    """{pk: (stamp, data)} of the cached rows of the model (name); entries of rows changed since aren't returned"""
+    cache = get_cache()
+    entries = {}
+    for pk in pks:
+        entry = cache.get((model, pk))
+        if entry is not None:
+            entries[pk] = entry
+    if cache.verify and entries:
+        stamps = Change.stamps(model, entries)
+        entries = {pk: entry for pk, entry in entries.items() if entry[0] == stamps[pk]}
+    return entries
+
+
+def set_rows(model, stamps, rows):
+    """rows: {pk: data}, read after their stamps ({pk: stamp}, Change.stamps), so a row can be newer than its stamp, not older"""
+    cache = get_cache()
+    for pk, data in rows.items():
+        cache.set((model, pk), (stamps[pk], data))
+    if not cache.verify and rows:   # changed (and invalidated) after the stamps were read, the entry would be served
+        current = Change.stamps(model, rows)
+        cache.delete_many([(model, pk) for pk in rows if current[pk] != stamps[pk]])
+
+
+@receiver(rows_changed)
+def invalidate(sender, pks, **kwargs):
+    keys = [(sender._meta.model_name, pk) for pk in pks]
+    cache = get_cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))   # the old row could be cached (by other thread) until the commit
@@ -0,0 +1,46 @@
+"""change feed (GET /changes?since=<seq>): rows changed since the last sync of a downstream system (search, caches, ..)
+
+Each change of a row (signals.rows_changed: imports, UpdateMixin.update, admin, ..) is recorded in the writing transaction
+as Change(seq, model, row_id) with a new, increasing seq; the older record of the same row is deleted. So the feed has
+each changed row once and its size is the count of changed rows, not of all rows.
+
+With concurrent writers (PostgreSQL, ..), a transaction can commit a smaller seq later than another one has committed
+a greater one, so clients should read again from a bit before their last seq (rows are repeated, not lost).
+"""
+from django.dispatch import receiver
+
+from .importer import ModelSwitch
+from .models import Change, chunks
+from .readers import get_reader
+from .signals import rows_changed
+
+
+@receiver(rows_changed)
+def record(sender, pks, **kwargs):
+    model = sender._meta.model_name
+    for pks_chunk in chunks(set(pks)):
+        Change.objects.filter(model=model, row_id__in=pks_chunk).delete()
+        Change.objects.bulk_create([Change(model=model, row_id=pk) for pk in pks_chunk])
+
+
+def changes(since=0, limit=1000, models=None, payload=False):
+    """[{'seq':.., 'model':.., 'id':..}] of changes after the seq, in the order of seq, 1 query
+    models : names of models (lowercase), None: all
+    payload : add 'data' (the same as Detail) or 'deleted': True for deleted rows, 1 query (+ m2m) per model
+    """
+    rows = Change.objects.filter(seq__gt=since).order_by('seq')
+    if models is not None:
+        rows = rows.filter(model__in=models)
+    feed = [{'seq': seq, 'model': model, 'id': pk} for seq, model, pk in rows.values_list('seq', 'model', 'row_id')[:limit]]
+    if payload:
+        pks = {}
+        for change in feed:
+            pks.setdefault(change['model'], []).append(change['id'])
+        data = {model: get_reader(ModelSwitch.classes(model)[0]).rows(model_pks) for model, model_pks in pks.items()}
+        for change in feed:
+            row = data[change['model']].get(change['id'])
+            if row is None:
+                change['deleted'] = True
+            else:
+                change['data'] = row
+    return feed
@@ -0,0 +1,56 @@
+"""database routing and connection setup
+
+PrimaryReplicaRouter (settings.DATABASE_ROUTERS): writes go to the primary database ('default'), reads to
+settings.DATABASE_READ_ALIAS (a replica), except:
+    - inside a transaction of the primary (the import reads its own writes)
+    - in use_primary() blocks (views of imports, background jobs: they read what they are going to write)
+For SQLite, the read alias can be the same file: with WAL, readers use their own connection and are not blocked by
+the transaction of an import (and the data have no replication lag).
+
+SQLite connections get settings.SQLITE_PRAGMAS when they are opened (WAL, synchronous, cache size, ..).
+"""
+import threading
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_local = threading.local()   # .pinned: count of use_primary() blocks of this thread
+
+
+class use_primary(ContextDecorator):
+    """all reads of this thread from the primary database: with use_primary(): .. or @use_primary()"""
+    def __enter__(self):
+        _local.pinned = getattr(_local, 'pinned', 0) + 1
+        return self
+
+    def __exit__(self, *exc):
+        _local.pinned -= 1
+        return False
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = getattr(settings, 'DATABASE_READ_ALIAS', None)
+        if not alias or getattr(_local, 'pinned', 0) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True   # the same data in all databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS   # replicas get the schema from the primary
+
+
+@receiver(connection_created)
+def setup_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+                cursor.execute('PRAGMA %s = %s' % (pragma, value))
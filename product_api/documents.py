@@ -0,0 +1,56 @@
+"""expanded product document: the product with its attributes (names + values), images and catalogs in one response
+
+    {<product fields>,
+     'attributes': [{'id': <ProductAttributes id>, 'attribute': <Attribute id>, 'nazev': {<AttributeName>}, 'hodnota': {<AttributeValue>}}],
+     'images': [{'id': <ProductImage id>, 'nazev': .., 'obrazek': {<Image>}}],
+     'catalogs': [<Catalog id's>]}
+
+Any number of documents is built with 4 queries (products + prefetched attributes, images, catalogs).
+"""
+from django.db.models import Prefetch
+
+from . import models
+from .readers import get_reader
+
+DOCUMENT_MODELS = ['product', 'productattributes', 'attribute', 'attributename', 'attributevalue', 'productimage', 'image', 'catalog']   # the document changes with them
+
+
+def product_queryset():
+    return models.Product.objects.order_by('pk').prefetch_related(
+        Prefetch('productattributes_set', queryset=models.ProductAttributes.objects.order_by('pk').select_related(
+            'attribute__nazev_atributu_id', 'attribute__hodnota_atributu_id')),
+        Prefetch('productimage_set', queryset=models.ProductImage.objects.order_by('pk').select_related('obrazek_id')),
+        Prefetch('catalogs', queryset=models.Catalog.objects.order_by('pk').only('pk')),
+    )
+
+
+def product_document(product):
+    """document of the product from product_queryset()"""
+    product_reader, name_reader, value_reader, image_reader = (
+        get_reader(Model) for Model in (models.Product, models.AttributeName, models.AttributeValue, models.Image))
+    document = product_reader.data(product)
+    document['attributes'] = [{
+        'id': product_attribute.pk,
+        'attribute': product_attribute.attribute_id,
+        'nazev': name_reader.data(product_attribute.attribute.nazev_atributu_id),
+        'hodnota': value_reader.data(product_attribute.attribute.hodnota_atributu_id),
+    } for product_attribute in product.productattributes_set.all()]
+    document['images'] = [{
+        'id': product_image.pk,
+        'nazev': product_image.nazev,
+        'obrazek': image_reader.data(product_image.obrazek_id),
+    } for product_image in product.productimage_set.all()]
+    document['catalogs'] = [catalog.pk for catalog in product.catalogs.all()]
+    return document
+
+
+def product_documents(after=0, limit=None, pks=None):
+    """list of documents of products with id > after (max. limit of them), or with id in pks"""
+    products = product_queryset()
+    if pks is not None:
+        products = products.filter(pk__in=pks)
+    if after:
+        products = products.filter(pk__gt=after)
+    if limit:
+        products = products[:limit]
+    return [product_document(product) for product in products]
@@ -0,0 +1,64 @@
+"""export of the product models (GET /export) in the format of /import: [{"Model": {"id": NNN, <other values>}}] or NDJSON
+
+Models are exported in their import order (MODELSWITCH), rows in the order of pk, so the export imported into an empty
+database gives the same data. Rows are read by server-side iteration over .values() and serialized by readers.py
+(the same data as Detail), chunk by chunk, so memory doesn't grow with the size of the catalog.
+"""
+from .importer import MODELSWITCH
+from .models import Change
+from .readers import get_reader
+from .renderers import JSONRenderer
+
+CHUNK_SIZE = 2000   # rows fetched from the database at once (their ManyToMany links by CHUNK pk's, see ReadSerializer.links)
+
+
+def export_models(models=None):
+    """Model classes in the import order; models: names (lowercase), None: all"""
+    return [Model for name, (Model, _Serializer, _import_order) in sorted(MODELSWITCH.items(), key=lambda item: item[1][2])
+            if models is None or name in models]
+
+
+def iter_items(models, chunk_size=CHUNK_SIZE):
+    """yield items {"Model": data} of all rows of the models"""
+    for Model in models:
+        reader = get_reader(Model)
+        pk_column = Model._meta.pk.attname
+        chunk = []
+        for values in Model.objects.order_by('pk').values(*reader.columns).iterator(chunk_size=chunk_size):
+            chunk.append(values)
+            if len(chunk) == chunk_size:
+                yield from represent(Model, reader, pk_column, chunk)
+                chunk = []
+        yield from represent(Model, reader, pk_column, chunk)
+
+
+def represent(Model, reader, pk_column, rows):
+    links = reader.links([values[pk_column] for values in rows])
+    for values in rows:
+        pk = values[pk_column]
+        yield {Model.__name__: reader.represent(values, {name: related[pk] for name, related in links.items()})}
+
+
+def export_json(models, ndjson=False, items_per_part=500):
+    """parts of the export (bytes) for StreamingHttpResponse: JSON list, or NDJSON (1 item per line); see views.json_list"""
+    render = JSONRenderer().render
+    joiner, end = (b'\n', b'\n') if ndjson else (b',\n', b'')
+    if not ndjson:
+        yield b'['
+    separator = b''
+    part = []
+    for item in iter_items(models):
+        part.append(render(item))
+        if len(part) == items_per_part:
+            yield separator + joiner.join(part) + end
+            separator = b'' if ndjson else joiner
+            part = []
+    if part:
+        yield separator + joiner.join(part) + end
+    if not ndjson:
+        yield b']'
+
+
+def last_seq():
+    """seq of the change feed (see changes.py) before the export: /changes?since=<seq> gives the rows changed during and after it"""
+    return Change.objects.order_by('-seq').values_list('seq', flat=True).first() or 0
@@ -0,0 +1,123 @@
+"""attribute facets: products filtered by attributes (name = value) and counts of products for each attribute value
+
+Inverted index FacetPosting: Attribute (a name + value pair) -> sorted array of product id's (uint32, native byte order).
+It is updated incrementally from signals.rows_changed of ProductAttributes, inside the writing transaction
+(FacetLink remembers the attribute of each ProductAttributes row, so we know which postings the changed rows left).
+Each process keeps the index in memory, grouped by (name, value) texts, and reloads it if it changes (see ModelVersion).
+Queries are intersections of sets in memory.
+
+The migration 0009_rebuild_facets builds the index of existing rows; if it got out of sync, run: python manage.py rebuild_facets
+"""
+import threading
+from array import array
+
+from django.dispatch import receiver
+
+from .models import CHUNK, Attribute, Catalog, FacetLink, FacetPosting, ModelVersion, Product, ProductAttributes, chunks
+from .signals import rows_changed
+
+INDEX_MODELS = ['facetposting', 'attribute', 'attributename', 'attributevalue']   # in-memory index depends on them
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def pack(ids):
+    return array('I', sorted(ids)).tobytes()
+
+
+def unpack(data):
+    ids = array('I')
+    ids.frombytes(data)
+    return ids
+
+
+@receiver(rows_changed, sender=ProductAttributes)
+def product_attributes_changed(sender, pks, **kwargs):
+    attributes = set()   # their postings will be recomputed
+    for pks_chunk in chunks(pks):
+        attributes.update(FacetLink.objects.filter(pk__in=pks_chunk).values_list('attribute_id', flat=True))
+        links = [FacetLink(id=pk, attribute_id=attribute_id)
+                 for pk, attribute_id in ProductAttributes.objects.filter(pk__in=pks_chunk).values_list('pk', 'attribute_id')]
+        attributes.update(link.attribute_id for link in links)
+        FacetLink.objects.filter(pk__in=pks_chunk).delete()
+        FacetLink.objects.bulk_create(links)
+    update_postings(attributes)
+
+
+def update_postings(attributes):
+    """recompute postings of the attributes (id's)"""
+    for attributes_chunk in chunks(attributes):
+        products = {}
+        for attribute_id, product_id in ProductAttributes.objects.filter(attribute_id__in=attributes_chunk).values_list('attribute_id', 'product_id'):
+            products.setdefault(attribute_id, set()).add(product_id)
+        FacetPosting.objects.filter(attribute_id__in=attributes_chunk).delete()
+        FacetPosting.objects.bulk_create([FacetPosting(attribute_id=attribute_id, products=pack(ids)) for attribute_id, ids in products.items()])
+    ModelVersion.bump('facetposting')
+
+
+def rebuild():
+    """build the whole index from ProductAttributes"""
+    FacetLink.objects.all().delete()
+    FacetPosting.objects.all().delete()
+    links = []
+    products = {}
+    for pk, attribute_id, product_id in ProductAttributes.objects.values_list('pk', 'attribute_id', 'product_id').iterator():
+        links.append(FacetLink(id=pk, attribute_id=attribute_id))
+        products.setdefault(attribute_id, set()).add(product_id)
+    FacetLink.objects.bulk_create(links, batch_size=CHUNK)
+    FacetPosting.objects.bulk_create([FacetPosting(attribute_id=attribute_id, products=pack(ids)) for attribute_id, ids in products.items()], batch_size=CHUNK)
+    ModelVersion.bump('facetposting')
+
+
+class Index:
+    """in-memory index: {(name, value): sorted array of product id's}"""
+    def __init__(self, version):
+        self.version = version
+        self.pairs = {}
+        postings = dict(FacetPosting.objects.values_list('attribute_id', 'products'))
+        for attribute_id, name, value in Attribute.objects.values_list('pk', 'nazev_atributu_id__nazev', 'hodnota_atributu_id__hodnota'):
+            if attribute_id in postings:   # more attributes can have the same name + value
+                self.pairs.setdefault((name, value), set()).update(unpack(postings[attribute_id]))
+        self.pairs = {pair: array('I', sorted(ids)) for pair, ids in self.pairs.items()}
+
+
+def get_index():
+    """in-memory index, reloaded if something has changed (1 query)"""
+    global _index
+    version = ModelVersion.get_combined(INDEX_MODELS)[0]
+    with _index_lock:
+        if _index is None or _index.version != version:
+            _index = Index(version)
+        return _index
+
+
+def search(filters, catalog=None):
+    """products having all attribute names of filters, each of them with any of its values; only in the catalog, if given
+    filters: [(name, value)], texts of AttributeName.nazev, AttributeValue.hodnota
+    returns (product id's, facets) where facets are {(name, value): count of products}
+    """
+    index = get_index()
+    values = {}
+    for name, value in filters:
+        values.setdefault(name, set()).add(value)
+
+    products = None
+    for name, name_values in values.items():
+        matching = set()
+        for value in name_values:
+            matching.update(index.pairs.get((name, value), ()))
+        products = matching if products is None else products & matching
+    if catalog is not None:
+        Through = Catalog.products_ids.through
+        in_catalog = set(Through.objects.filter(catalog_id=catalog).values_list('product_id', flat=True))
+        products = in_catalog if products is None else products & in_catalog
+    if products is None:
+        products = set(Product.objects.values_list('pk', flat=True))
+
+    facets = {}
+    for pair, ids in index.pairs.items():
+        count = len(products.intersection(ids))
+        if count:
+            facets[pair] = count
+    return products, facets
@@ -0,0 +1,409 @@
+from itertools import groupby
+from operator import itemgetter
+
+from logzero import logger
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.db.models import UniqueConstraint
+
+from . import fingerprints, metrics, models, serializers
+from .models import ImportCheckpoint, chunks
+from .planner import Plan, import_order
+from .registry import IdRegistry
+from .signals import rows_changed
+
+FAILURE_STOP = False   # with first error stop update the database but preserve previous changes
+FAILURE_REVERT = True  # with first error revert all changes
+FAILURE_RESUME = 'resume'  # commit in chunks (settings.IMPORT_COMMIT_CHUNK items), with first error revert the chunk and stop;
+                           # the same payload is resumed from the failed chunk later (see ImportCheckpoint)
+
+FAILURE_MODE = FAILURE_REVERT  # FAILURE_STOP, FAILURE_REVERT or FAILURE_RESUME
+
+
+IMPORT_MODELS = [   # (Model, Serializer) of the tables which can be imported; the import order is derived from their FK/ManyToMany fields
+    (models.AttributeName, serializers.AttributeNameSerializer),
+    (models.AttributeValue, serializers.AttributeValueSerializer),
+    (models.Attribute, serializers.AttributeSerializer),
+    (models.Product, serializers.ProductSerializer),
+    (models.ProductAttributes, serializers.ProductAttributesSerializer),
+    (models.Image, serializers.ImageSerializer),
+    (models.ProductImage, serializers.ProductImageSerializer),
+    (models.Catalog, serializers.CatalogSerializer),
+]
+IMPORT_ORDER = import_order(Model for Model, _Serializer in IMPORT_MODELS)   # {Model: position}, see planner.py
+
+MODELSWITCH = {   # {table name: (Model, Serializer, import order)}, imports need sorting before they can be applied, with regard to FK
+    Model._meta.model_name: (Model, Serializer, IMPORT_ORDER[Model]) for Model, Serializer in IMPORT_MODELS
+}
+
+
+class ModelSwitch:
+    @staticmethod
+    def classes(model):
+        return MODELSWITCH.get(model.lower(), (None, None, None))
+
+
+class Importer:
+    """import or update rows in the database from a list of mappings: {tablename: {"id":NNN, <other_values>}}
+
+        importer = Importer()
+        importer.stage(data)   # check items, prepare changes
+        importer.run()         # validate + write (model by model, with bulk queries)
+        importer.results       # {'inserted': .., 'updated': .., 'errors': [..]}
+    """
+    def __init__(self, failure_mode=None, digest=None):
+        self.failure_mode = FAILURE_MODE if failure_mode is None else failure_mode
+        self.digest = digest  # of the payload (see fingerprints.payload_hash), checkpoints of FAILURE_RESUME are kept for it
+        self.checkpoint = None  # FAILURE_RESUME: count of committed items, if the import failed
+        self.errors = []
+        self.inserted = self.updated = 0
+        self.updates = []     # list of prepared changes: [serializer, import_order, row, fingerprint, unchanged]
+        self.failed = False   # after the 1st error we will never update the db more
+        self.registry = IdRegistry()   # rows which exist or are staged, for validation of FK/m2m values (see registry.py)
+
+    def add_error(self, msg):
+        self.errors.append(msg)
+
+    @property
+    def results(self):
+        results = {'inserted': self.inserted, 'updated': self.updated}
+        if self.errors:
+            results.update({'errors': self.errors})
+        if self.checkpoint is not None:
+            results.update({'checkpoint': self.checkpoint})
+        return results
+
+    def log(self):
+        msg = 'import - inserted %s, updated %s' % (self.inserted, self.updated)
+        collector = metrics.current()
+        if collector is not None:
+            msg += ' - ' + collector.summary()
+        if self.errors:
+            logger.error(msg + ' - errors (!)')
+            for err in self.errors:
+                logger.warning(err)
+        else:
+            logger.info(msg)
+
+    def stage(self, data):
+        """check the items and prepare the changes into self.updates"""
+        staged = []    # items which passed the basic checks: (Model, Serializer, import_order, pk, values)
+        for i, item in enumerate(data):
+            checked = self.check_item(i, item)
+            if checked:
+                staged.append(checked)
+        self.prepare(staged)
+
+    def check_item(self, i, item):
+        """basic checks of the item (i is its position, for error reporting)
+        returns (Model, Serializer, import_order, pk, values), or None if the item is wrong
+        """
+        kv = item.items() if isinstance(item, dict) else ()
+        if len(kv) != 1:
+            self.add_error("each item must contain 1 key (model name) and 1 value (inserted or updated values), which fails for: item %s" % i)
+            return None
+
+        for key, values in kv:
+            break
+
+        Model, Serializer, order = ModelSwitch.classes(key)
+        if Model is None:
+            self.add_error("each item must contain 1 key which must be a known model name, which fails for: item %s, %s" % (i, key))
+            return None
+
+        pk = values.get('id') if isinstance(values, dict) else None
+        if pk is None:
+            self.add_error("each item must contain the value 'id', which fails for: item %s, %s" % (i, key))
+            return None
+        try:
+            pk = Model._meta.pk.to_python(pk)   # "1" and 1 must be the same row (for index and for prefetched rows)
+        except ValidationError:
+            self.add_error("the value 'id' must be an integer, which fails for: item %s, %s" % (i, key))
+            return None
+
+        return Model, Serializer, order, pk, values
+
+    def prepare(self, staged):
+        """prepare changes (self.updates) from checked items: merge repeated id's, find rows which already exist"""
+        with metrics.phase('lookup'):
+            self.prepare_updates(staged)
+
+    def prepare_updates(self, staged):
+        plan = Plan()   # repeated id's merged in 1 pass (the earlier item wins), 1 serializer per row
+        for Model, Serializer, order, pk, values in staged:
+            plan.add(Model, Serializer, order, pk, values)
+        rows = plan.rows()
+        existing = prefetch_rows(rows)   # {Model: {pk: row}}, so we don't need 1 query per item
+
+        start = len(self.updates)
+        context = {'registry': self.registry}
+        for Model, pks in group_pks(rows).items():
+            self.registry.stage(Model, pks)
+        for Model, Serializer, order, pk, values in rows:
+            row = existing[Model].get(pk)
+            if row is None:   # id not in db
+                serializer = Serializer(data=values, context=context)
+            else:             # id exists in db
+                serializer = Serializer(row, data=values, context=context)   # we will use this for validation, but ...
+                # ... no idea how to force Update instead of Insert, so lets update using the model-instance
+                #   which (as everything) is not easy in Django, but see models.py:UpdateMixin
+            self.updates.append([serializer, order, row, None, False])  # row we need for the Update (using Model instead of Serializer) mentioned above
+        self.skip_unchanged(self.updates[start:])
+
+    def skip_unchanged(self, updates):
+        """set fingerprints of the prepared changes, existing rows with the same fingerprint as from their last import are unchanged"""
+        existing = {}   # {Model: [prepared changes of existing rows]}
+        for update in updates:
+            serializer, _import_order, row = update[:3]
+            update[3] = fingerprints.fingerprint(serializer.initial_data)
+            if row is not None:
+                existing.setdefault(type(row), []).append(update)
+        for Model, model_updates in existing.items():
+            last = fingerprints.stored(Model, [update[2].pk for update in model_updates])
+            for update in model_updates:
+                update[4] = last.get(update[2].pk) == update[3]
+
+    def run(self):
+        """validate and write the prepared changes, model by model in the import order (FK dependencies)"""
+        if self.errors:
+            return
+
+        with metrics.phase('sort'):
+            self.updates.sort(key=itemgetter(1))  # if we sort models into order based on FK dependencies, we can save the import in some cases (stable sort is good here!)
+        if self.failure_mode == FAILURE_RESUME:
+            self.run_chunks()
+            return
+        try:
+            with transaction.atomic():     # This code executes inside a transaction
+                for _import_order, group in groupby(self.updates, key=itemgetter(1)):
+                    self.write_group(list(group))
+                if self.failure_mode == FAILURE_REVERT and self.failed:
+                    raise RuntimeError  # break+revert transaction
+        except RuntimeError as exc:     # this is just to continue after transaction is reverted
+            self.inserted = self.updated = 0
+        except transaction.TransactionManagementError as exc:
+            self.inserted = self.updated = 0
+            self.add_error("+ transaction.TransactionManagementError (more SQL commands after Rollback)")
+
+    def run_chunks(self):
+        """FAILURE_RESUME: write the prepared changes in chunks, each of them in its own transaction (locks are held for 1 chunk only)
+        chunks committed by an earlier import of the same payload are skipped
+        """
+        done = ImportCheckpoint.get(self.digest)
+        position = 0
+        for _import_order, group in groupby(self.updates, key=itemgetter(1)):
+            for chunk in chunks(group, settings.IMPORT_COMMIT_CHUNK):
+                position += len(chunk)
+                if position > done and not self.commit_chunk(chunk, position - len(chunk), position):
+                    return
+        ImportCheckpoint.clear(self.digest)
+
+    def commit_chunk(self, chunk, start, end):
+        """FAILURE_RESUME: write a chunk of prepared changes of a single model in its own transaction
+        the checkpoint (end: position after the chunk) is committed with the chunk, so an interrupted import (killed process, ..)
+        is resumed after the last committed chunk too
+        if the chunk fails, it is reverted and self.checkpoint is set to its start; returns False then
+        """
+        inserted, updated = self.inserted, self.updated
+        try:
+            with transaction.atomic():
+                self.write_group(chunk)
+                if self.failed:
+                    raise RuntimeError  # break+revert transaction
+                ImportCheckpoint.save_position(self.digest, end)
+        except RuntimeError:
+            self.inserted, self.updated = inserted, updated
+            self.checkpoint = start
+            return False
+        return True
+
+    def write_group(self, group):
+        """validate rows of a single model and write the valid ones (up to the 1st error) using bulk queries
+        models of later groups reference rows of this one, so the group must be written before the next one is validated
+        """
+        Model = group[0][0].Meta.model
+        valid = []
+        written = []   # [(pk, fingerprint)] of valid rows
+        invalid = []   # pk's of new rows which aren't valid
+        changed = [(serializer, row, fingerprint) for serializer, _import_order, row, fingerprint, unchanged in group
+                   if not unchanged]   # unchanged: the same values as from the last import and the row hasn't changed since
+        with metrics.phase('validate'):
+            self.registry.load_references([serializer for serializer, _row, _fingerprint in changed])
+            checked = [serializer.is_valid() for serializer, _row, _fingerprint in changed]
+            clashes = unique_clashes(Model, [(row_pk(serializer) if row is None else row.pk, serializer.validated_data)
+                                             for (serializer, row, _fingerprint), ok in zip(changed, checked) if ok])
+            clashes = iter(clashes)   # 1 item for each valid row
+            for (serializer, row, fingerprint), ok in zip(changed, checked):
+                errors = next(clashes) if ok else serializer.errors
+                if not errors:
+                    if not self.failed:
+                        valid.append((serializer, row))
+                        written.append((row_pk(serializer) if row is None else row.pk, fingerprint))
+                else:
+                    self.failed = True
+                    self.add_error(invalid_message(serializer, errors))
+                    if row is None:
+                        invalid.append(row_pk(serializer))
+        # new rows which can never be written don't exist for the validation of the next groups (their rows referencing them
+        # aren't valid); valid rows not written only because of an earlier error stay, so they don't cause more errors
+        self.registry.discard(Model, invalid)
+        if not valid or self.failed and self.failure_mode != FAILURE_STOP:   # everything (the chunk) will be reverted anyway
+            return
+
+        with metrics.phase('write'):
+            try:
+                with transaction.atomic():   # savepoint: if some row breaks the bulk write, ..
+                    self.updated += bulk_write(valid)
+            except DatabaseError:
+                del written[self.write_rows(valid):]   # .. we repeat it row by row to find (and report) the row
+                if len(written) < len(valid) and valid[len(written)][1] is None:   # the new row which failed
+                    self.registry.discard(Model, [row_pk(valid[len(written)][0])])
+            fingerprints.save(Model, written)
+        self.inserted += sum(1 for _serializer, row in valid[:len(written)] if row is None)   # written new rows
+
+    def write_rows(self, valid):
+        """write rows one by one (slow, used only if bulk write failed), returns count of written rows"""
+        for i, (serializer, row) in enumerate(valid):
+            try:
+                with transaction.atomic():
+                    if row:   # Update instead of Insert (because I have no idea how to implement such a stupid thing with serializer itself)
+                        row.refresh_from_db()    # failed bulk_write has already changed the instance
+                        if row.update(**serializer.validated_data):   # see models.py:UpdateMixin
+                            self.updated += 1
+                    else:
+                        data, m2m = split_m2m(serializer)
+                        instance = serializer.Meta.model(pk=row_pk(serializer), **data)
+                        instance.save(force_insert=True)
+                        for field, value in m2m.items():
+                            getattr(instance, field).set(value)
+            except Exception as exc:
+                # raise exc  # for Debug purposes
+                self.failed = True
+                self.add_error("cannot update database (integrity error,..), %s %s" % (model_name(serializer), serializer.initial_data))
+                return i
+        return len(valid)
+
+
+def prefetch_rows(staged):
+    """load all rows which already exist in the database for the staged items: {Model: {pk: row}}
+    1 query per model (in_bulk splits it into more queries if there is too much id's for the database, ie. SQLite limit of variables)
+    pk's of m2m related objects are loaded too, because UpdateMixin.changes compares them
+    """
+    existing = {}
+    for Model, pks in group_pks(staged).items():
+        existing[Model] = Model.objects.in_bulk(pks)
+        Model.prefetch_m2m_pks(list(existing[Model].values()))
+    return existing
+
+
+def group_pks(staged):
+    """{Model: set of pk's} of the staged items"""
+    ids = {}
+    for Model, _Serializer, _import_order, pk, _values in staged:
+        ids.setdefault(Model, set()).add(pk)
+    return ids
+
+
+def bulk_write(valid):
+    """write validated rows of a single model: 1 bulk insert, 1 bulk update, for each m2m field: delete of removed links + 1 bulk insert of added ones
+    valid: [(serializer, row)], row is None for new rows
+    returns number of really updated rows
+    """
+    Model = valid[0][0].Meta.model
+    new = []
+    changed = []
+    update_fields = set()
+    links = {}   # {m2m field: {pk: (added pk's, removed pk's)}}, changed links of these rows
+    updated = 0
+    for serializer, row in valid:
+        if row is None:
+            data, m2m = split_m2m(serializer)
+            row = Model(pk=row_pk(serializer), **data)
+            new.append(row)
+            m2m = {field: ({obj.pk for obj in value}, ()) for field, value in m2m.items()}
+        else:
+            fields, m2m = row.changes(**serializer.validated_data)   # see models.py:UpdateMixin
+            if fields:
+                changed.append(row)
+                update_fields.update(fields)
+            if fields or m2m:
+                updated += 1
+        for field, value in m2m.items():
+            links.setdefault(field, {})[row.pk] = value
+
+    Model.objects.bulk_create(new)
+    if changed:
+        Model.objects.bulk_update(changed, update_fields)
+    for field, rows in links.items():
+        fld = Model._meta.get_field(field)
+        Through = fld.remote_field.through
+        source = fld.m2m_column_name()           # catalog_id
+        target = fld.m2m_reverse_name()          # product_id
+        removed = {(pk, target_pk) for pk, (_added, removed_pks) in rows.items() for target_pk in removed_pks}
+        if removed:
+            for sources in chunks({pk for pk, _target_pk in removed}):
+                ids = [link_pk for link_pk, source_pk, target_pk in Through.objects.filter(**{source + '__in': sources}).values_list('pk', source, target)
+                       if (source_pk, target_pk) in removed]
+                for ids_chunk in chunks(ids):
+                    Through.objects.filter(pk__in=ids_chunk).delete()
+        Through.objects.bulk_create([Through(**{source: pk, target: target_pk}) for pk, (added, _removed) in rows.items() for target_pk in added])
+
+    pks = {row.pk for row in new}.union((row.pk for row in changed), *links.values())
+    if pks:
+        rows_changed.send(sender=Model, pks=list(pks))   # bulk queries don't send model signals
+    return updated
+
+
+def split_m2m(serializer):
+    """validated data of the serializer split into: ({field: value} for the model constructor, {m2m field: [objects]})"""
+    data = dict(serializer.validated_data)
+    m2m = {fld.name: data.pop(fld.name) for fld in serializer.Meta.model._meta.many_to_many if fld.name in data}
+    return data, m2m
+
+
+def row_pk(serializer):
+    """id required by the imported item (id is read-only for serializers, so it isn't in validated_data)"""
+    return serializer.Meta.model._meta.pk.to_python(serializer.initial_data['id'])
+
+
+def unique_clashes(Model, rows):
+    """unique constraints (Meta.constraints, not validated by DRF: UniqueTogetherValidator makes 1 query per item) of valid
+    rows [(pk, validated_data)], checked in bulk against the earlier rows of the list and the other rows in the database
+    returns errors (as serializer.errors, None if the row is valid) for each row
+    """
+    errors = [None] * len(rows)
+    pks = {pk for pk, _data in rows}   # their values in the database will be replaced
+    for constraint in Model._meta.constraints:
+        if not isinstance(constraint, UniqueConstraint) or constraint.condition is not None:
+            continue
+        fields = [Model._meta.get_field(name) for name in constraint.fields]
+        message = {'non_field_errors': ['The fields %s must make a unique set.' % ', '.join(constraint.fields)]}
+        keys = {}   # {values: index of the 1st row with them}
+        for i, (_pk, data) in enumerate(rows):
+            if errors[i] is None and all(field.name in data for field in fields):
+                key = tuple(getattr(data[field.name], 'pk', data[field.name]) for field in fields)   # FK: Model(pk=..)
+                if key in keys:
+                    errors[i] = message
+                else:
+                    keys[key] = i
+        first = fields[0].attname
+        for values_chunk in chunks({key[0] for key in keys}):
+            for pk, *key in Model.objects.filter(**{first + '__in': values_chunk}).values_list('pk', *[field.attname for field in fields]):
+                i = keys.get(tuple(key))
+                if i is not None and pk not in pks:
+                    errors[i] = message
+    return errors
+
+
+def invalid_message(serializer, errors):
+    """error message for an item which isn't valid (errors: serializer.errors or a part of them)"""
+    err = []
+    for k in errors:
+        err.append('%s : %s' % (k, ', '.join(errors[k])))
+    return "data aren't valid: %s %s (%s)" % (model_name(serializer), serializer.initial_data, '; '.join(err))
+
+
+def model_name(serializer):  # for error reporting only
+    return serializer.Meta.model.__name__
@@ -0,0 +1,144 @@
+"""background imports (POST /import?async=1): the payload is stored into a file and imported by a thread pool of this process
+
+Jobs are stored in the ImportJob model. Progress of a running job is kept in memory only (the job writes inside its
+import transaction, so it can't save the progress into the database), so only the process which runs the job reports it.
+
+The queue is in memory too: jobs left queued or running by a stopped process are requeued by recover()
+(manage.py recover_import_jobs, run before the servers start).
+"""
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from logzero import logger
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from . import metrics
+from .db import use_primary
+from .importer import FAILURE_REVERT
+from .models import ImportJob
+from .streaming import StreamImporter
+
+_executor = None
+_executor_lock = threading.Lock()
+_running = {}   # {job pk: JobImporter} of jobs running in this process
+
+
+class JobImporter(StreamImporter):
+    def __init__(self, job, **kwargs):
+        super().__init__(**kwargs)
+        self.job = job
+
+    def progress(self):
+        self.job.processed = self.processed
+
+
+def create(stream):
+    """store the payload from a binary stream and queue its import; returns ImportJob"""
+    job_dir = settings.IMPORT_JOB_DIR
+    os.makedirs(job_dir, exist_ok=True)
+    job = ImportJob.objects.create()
+    job.payload = os.path.join(job_dir, 'import_%s.json' % job.pk)
+    with open(job.payload, 'wb') as f:
+        shutil.copyfileobj(stream, f)
+    job.save(update_fields=['payload'])
+
+    if settings.IMPORT_JOB_WORKERS:
+        executor().submit(work, job.pk)
+    else:
+        run(job)   # no background workers, run the job in the request (debugging, tests)
+    return job
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMPORT_JOB_WORKERS, thread_name_prefix='import-job')
+    return _executor
+
+
+def work(pk):
+    """run the job in a worker thread"""
+    try:
+        with metrics.collect('import_job'), use_primary():   # queries of this thread (the request has already ended)
+            run(ImportJob.objects.get(pk=pk))
+    except Exception:
+        logger.exception('import job %s' % pk)
+    finally:
+        connections.close_all()   # connections of the worker thread
+
+
+def run(job):
+    """import the stored payload of the job (see Importer) and save the results into the job"""
+    importer = JobImporter(job)
+    _running[job.pk] = importer
+    job.status = ImportJob.RUNNING
+    job.save(update_fields=['status'])
+    try:
+        with open(job.payload, 'rb') as f:
+            importer.stage(f)
+        job.total = importer.total
+        importer.run()
+        importer.log()
+        job.status = ImportJob.FAILED if importer.errors and importer.failure_mode == FAILURE_REVERT else ImportJob.DONE
+    except ValueError as exc:
+        importer.add_error('cannot parse the data: %s' % exc)
+        job.status = ImportJob.FAILED
+    except Exception as exc:
+        importer.add_error('import failed: %s' % exc)
+        job.status = ImportJob.FAILED
+        raise
+    finally:
+        del _running[job.pk]
+        job.inserted = importer.inserted
+        job.updated = importer.updated
+        job.errors = json.dumps(importer.errors) if importer.errors else ''
+        job.finished = timezone.now()
+        job.save()
+        os.remove(job.payload)
+
+
+def recover():
+    """jobs left queued or running by a stopped process: requeue the jobs with a stored payload (the writes of a running
+    job were rolled back with its transaction), fail the others; returns the requeued jobs, to be run by work(pk)
+    """
+    requeued = []
+    for job in ImportJob.objects.filter(status__in=[ImportJob.QUEUED, ImportJob.RUNNING]).order_by('pk'):
+        if os.path.exists(job.payload):
+            job.status = ImportJob.QUEUED
+            job.total = job.processed = job.inserted = job.updated = 0
+            job.errors = ''
+            requeued.append(job)
+        else:
+            job.status = ImportJob.FAILED
+            job.errors = json.dumps(['import interrupted, the stored payload is lost'])
+            job.finished = timezone.now()
+        job.save()
+    return requeued
+
+
+def status(job):
+    """status of the job in the format of import results: {'job':.., 'status':.., 'inserted':.., 'updated':.., 'errors': [..]}"""
+    results = {
+        'job': job.pk,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'inserted': job.inserted,
+        'updated': job.updated,
+    }
+    importer = _running.get(job.pk)
+    if importer is not None:   # running in this process, we have live numbers
+        results.update({'total': importer.total, 'processed': importer.processed, 'inserted': importer.inserted, 'updated': importer.updated})
+        errors = importer.errors
+    else:
+        errors = json.loads(job.errors) if job.errors else []
+    if errors:
+        results['errors'] = errors
+    return results
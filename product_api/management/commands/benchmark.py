@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from product_api import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Benchmark of /import, List and Detail with a synthetic feed, in new test databases; '
+            'prints the JSON report (compare reports of different commits with the same options)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000, help='size of the feed (1000 .. 1000000)')
+        parser.add_argument('--attributes', type=int, default=3, help='attributes of each product and catalog')
+        parser.add_argument('--catalogs', type=int, default=10)
+        parser.add_argument('--catalog-size', type=int, default=100, help='products of each catalog')
+        parser.add_argument('--requests', type=int, default=1000, help='rows read by the List/Detail scenarios')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-memory', action='store_true', help='without tracemalloc (faster, no peak memory)')
+        parser.add_argument('--output', help='write the report into this file')
+        parser.add_argument('--feed', help='write the generated feed into this file (for curl), no benchmark')
+
+    def handle(self, *args, **options):
+        if options['feed']:
+            with open(options['feed'], 'w', encoding='utf-8') as f:
+                json.dump(benchmark.generate(options['items'], options['attributes'], options['catalogs'],
+                                             options['catalog_size'], seed=options['seed']), f, ensure_ascii=False)
+            return
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)   # all aliases, as in tests: the read alias mirrors 'default'
+        try:
+            report = benchmark.Benchmark(
+                items=options['items'], attributes=options['attributes'], catalogs=options['catalogs'],
+                catalog_size=options['catalog_size'], requests=options['requests'], seed=options['seed'],
+                memory=not options['no_memory'], log=self.stderr.write).run()
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        self.stdout.write(text)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from product_api import facets
+
+
+class Command(BaseCommand):
+    help = 'Build the attribute facet index (FacetPosting) from ProductAttributes'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            facets.rebuild()
+        self.stdout.write('facet index rebuilt')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from product_api import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the background imports left queued or running by stopped processes (run before the servers start)'
+
+    def handle(self, *args, **options):
+        requeued = jobs.recover()
+        for job in requeued:
+            jobs.work(job.pk)
+        self.stdout.write('%s import jobs recovered' % len(requeued))
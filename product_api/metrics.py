@@ -0,0 +1,157 @@
+"""metrics of requests and imports: count of SQL queries, time in the database, in phases (parse, lookup, .., serialize) and total
+
+    MetricsMiddleware : collects metrics of each request of the API (endpoint = name of the url without 'view_', model)
+    phase(name) : context manager, time and queries of a part of the work (import phases, serialization, ..)
+    collect(endpoint, model) : context manager, collects metrics of work outside of requests (background imports)
+    GET /metrics : Prometheus text format, from local addresses only (settings.METRICS_ALLOWED_IPS)
+
+Metrics are kept in the memory of the process (each process of the server reports its own numbers).
+"""
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)   # histogram of queries per request (N+1 regressions)
+
+_local = threading.local()   # .collector: Collector of the current request/job
+_lock = threading.Lock()
+_registry = {}   # {(metric name, labels): value}, labels are tuples of (name, value)
+
+
+class Collector:
+    """metrics of a single request or job"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = {}   # {name: [seconds, queries, db seconds]}
+
+    def __call__(self, execute, sql, params, many, context):   # connection.execute_wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def summary(self):
+        """text for the log"""
+        phases = ', '.join('%s %.3f s/%s q' % (name, seconds, queries) for name, (seconds, queries, _db_time) in self.phases.items())
+        return '%s queries, db %.3f s, total %.3f s%s' % (
+            self.queries, self.db_time, time.perf_counter() - self.start, ' (%s)' % phases if phases else '')
+
+
+def current():
+    """Collector of the current request/job or None"""
+    return getattr(_local, 'collector', None)
+
+
+@contextmanager
+def collect(endpoint=None, model=None):
+    """collect metrics of the work inside (queries of all database connections of this thread)
+    with endpoint, the metrics are recorded when it ends; yields the Collector
+    """
+    collector = Collector()
+    previous = current()
+    _local.collector = collector
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(collector))
+            yield collector
+    finally:
+        _local.collector = previous
+        if endpoint:
+            record(collector, endpoint, model)
+
+
+@contextmanager
+def phase(name):
+    """add time and queries of the work inside into the phase of the current request/job (nothing if metrics aren't collected)"""
+    collector = current()
+    if collector is None:
+        yield
+        return
+    start, queries, db_time = time.perf_counter(), collector.queries, collector.db_time
+    try:
+        yield
+    finally:
+        totals = collector.phases.setdefault(name, [0.0, 0, 0.0])
+        totals[0] += time.perf_counter() - start
+        totals[1] += collector.queries - queries
+        totals[2] += collector.db_time - db_time
+
+
+def add(name, labels, value):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _registry[key] = _registry.get(key, 0) + value
+
+
+def record(collector, endpoint, model, status=None):
+    labels = {'endpoint': endpoint, 'model': model or ''}
+    add('requests_total', dict(labels, status=str(status or '')), 1)
+    add('request_duration_seconds_sum', labels, time.perf_counter() - collector.start)
+    add('request_duration_seconds_count', labels, 1)
+    add('db_queries_total', labels, collector.queries)
+    add('db_duration_seconds_total', labels, collector.db_time)
+    for bucket in QUERY_BUCKETS + ('+Inf',):   # all buckets, even the empty ones
+        add('request_queries_bucket', dict(labels, le=str(bucket)), int(bucket == '+Inf' or collector.queries <= bucket))
+    add('request_queries_sum', labels, collector.queries)
+    add('request_queries_count', labels, 1)
+    for name, (seconds, queries, db_time) in collector.phases.items():
+        phase_labels = dict(labels, phase=name)
+        add('phase_duration_seconds_total', phase_labels, seconds)
+        add('phase_queries_total', phase_labels, queries)
+        add('phase_db_duration_seconds_total', phase_labels, db_time)
+
+
+class MetricsMiddleware:
+    """metrics of the requests of the API views (urls named view_..)"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect() as collector:
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is not None and match.url_name and match.url_name.startswith('view_'):
+            model = match.kwargs.get('model', '').lower()
+            if model:
+                from .importer import MODELSWITCH
+                model = model if model in MODELSWITCH else 'unknown'   # labels must not come from the client
+            record(collector, match.url_name[5:], model, response.status_code)
+        return response
+
+
+TYPES = {'requests_total': 'counter', 'request_duration_seconds': 'summary', 'db_queries_total': 'counter',
+         'db_duration_seconds_total': 'counter', 'request_queries': 'histogram', 'phase_duration_seconds_total': 'counter',
+         'phase_queries_total': 'counter', 'phase_db_duration_seconds_total': 'counter'}
+
+
+def sort_key(item):
+    """metrics of a family together, buckets of a histogram together and in ascending order"""
+    (name, labels), _value = item
+    return name, [(label, text) for label, text in labels if label != 'le'], [float(text) for label, text in labels if label == 'le']
+
+
+def metrics_view(request):
+    """GET /metrics : all metrics in the Prometheus text format"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    with _lock:
+        values = sorted(_registry.items(), key=sort_key)
+    lines = []
+    declared = set()
+    for (name, labels), value in values:
+        family = next((family for family in TYPES if name == family or name.startswith(family + '_')), name)
+        if family not in declared:
+            declared.add(family)
+            lines.append('# TYPE product_api_%s %s' % (family, TYPES.get(family, 'untyped')))
+        labels = ','.join('%s="%s"' % (label, text.replace('\\', '\\\\').replace('"', '\\"')) for label, text in labels)
+        lines.append('product_api_%s{%s} %s' % (name, labels, value))
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
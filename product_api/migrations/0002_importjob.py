@@ -0,0 +1,28 @@
+# Generated by Django 2.2.3 on 2026-10-17 21:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=10, verbose_name='Status')),
+                ('payload', models.CharField(max_length=255, verbose_name='Stored payload')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Finished')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Items')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Processed items')),
+                ('inserted', models.PositiveIntegerField(default=0, verbose_name='Inserted')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='Updated')),
+                ('errors', models.TextField(blank=True, verbose_name='Errors (json)')),
+            ],
+        ),
+    ]
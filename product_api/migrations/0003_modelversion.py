@@ -0,0 +1,22 @@
+# Generated by Django 2.2.3 on 2026-10-17 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0002_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, unique=True, verbose_name='Model')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Version')),
+                ('modified', models.DateTimeField(blank=True, null=True, verbose_name='Modified')),
+            ],
+        ),
+    ]
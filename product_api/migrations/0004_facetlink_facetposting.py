@@ -0,0 +1,28 @@
+# Generated by Django 2.2.3 on 2026-10-17 21:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0003_modelversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetLink',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False, verbose_name='Product attribute')),
+                ('attribute_id', models.IntegerField(db_index=True, verbose_name='Attribute')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FacetPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attribute_id', models.IntegerField(unique=True, verbose_name='Attribute')),
+                ('products', models.BinaryField(verbose_name='Products (sorted array of uint32)')),
+            ],
+        ),
+    ]
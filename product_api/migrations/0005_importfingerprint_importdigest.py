@@ -0,0 +1,35 @@
+# Generated by Django 2.2.3 on 2026-10-17 21:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0004_facetlink_facetposting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportDigest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32, unique=True, verbose_name='Digest')),
+                ('version', models.BigIntegerField(verbose_name='Version of the data')),
+                ('results', models.TextField(verbose_name='Results (json)')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportFingerprint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='Model')),
+                ('row_id', models.IntegerField(verbose_name='Row')),
+                ('digest', models.CharField(max_length=32, verbose_name='Digest')),
+            ],
+            options={
+                'unique_together': {('model', 'row_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.3 on 2026-10-17 21:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0005_importfingerprint_importdigest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32, unique=True, verbose_name='Digest of the payload')),
+                ('position', models.BigIntegerField(verbose_name='Committed items')),
+                ('modified', models.DateTimeField(auto_now=True, verbose_name='Modified')),
+            ],
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 2.2.3 on 2026-10-17 21:45
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+import django.db.models.deletion
+
+
+def duplicates(queryset, fields):
+    """{pk: kept pk} of the rows with the same values of the fields, the lowest pk of each group is kept"""
+    replaced = {}
+    groups = queryset.values(*fields).annotate(kept=Min('pk'), rows=Count('pk')).filter(rows__gt=1)
+    for group in groups:
+        kept = group.pop('kept')
+        group.pop('rows')
+        for pk in queryset.filter(**group).exclude(pk=kept).values_list('pk', flat=True):
+            replaced[pk] = kept
+    return replaced
+
+
+def deduplicate(apps, schema_editor):
+    """the unique constraints below can't be added while the tables have duplicate rows (older imports didn't prevent them):
+    duplicate attributes are replaced by the kept one in their references, then duplicate product attributes are deleted
+    """
+    Attribute = apps.get_model('product_api', 'Attribute')
+    ProductAttributes = apps.get_model('product_api', 'ProductAttributes')
+    CatalogAttributes = apps.get_model('product_api', 'Catalog').attributes_ids.through
+
+    replaced = duplicates(Attribute.objects.all(), ['nazev_atributu_id', 'hodnota_atributu_id'])
+    for pk, kept in replaced.items():
+        ProductAttributes.objects.filter(attribute_id=pk).update(attribute_id=kept)
+        catalogs = CatalogAttributes.objects.filter(attribute_id=kept).values_list('catalog_id', flat=True)
+        CatalogAttributes.objects.filter(attribute_id=pk, catalog_id__in=list(catalogs)).delete()   # linked to both
+        CatalogAttributes.objects.filter(attribute_id=pk).update(attribute_id=kept)
+    Attribute.objects.filter(pk__in=list(replaced)).delete()
+    ProductAttributes.objects.filter(pk__in=list(duplicates(ProductAttributes.objects.all(), ['product', 'attribute']))).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0006_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='attribute',
+            name='nazev_atributu_id',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='product_api.AttributeName', verbose_name='Attribute name'),
+        ),
+        migrations.AlterField(
+            model_name='productattributes',
+            name='attribute',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='product_api.Attribute', verbose_name='Attribute'),
+        ),
+        migrations.AlterField(
+            model_name='productattributes',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='product_api.Product', verbose_name='Product'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_published', 'published_on'], name='product_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productattributes',
+            index=models.Index(fields=['attribute', 'product'], name='attribute_product_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='attribute',
+            constraint=models.UniqueConstraint(fields=('nazev_atributu_id', 'hodnota_atributu_id'), name='attribute_name_value_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='productattributes',
+            constraint=models.UniqueConstraint(fields=('product', 'attribute'), name='product_attribute_unique'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.3 on 2026-10-17 21:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0007_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False, verbose_name='Sequence')),
+                ('model', models.CharField(max_length=100, verbose_name='Model')),
+                ('row_id', models.IntegerField(verbose_name='Row')),
+            ],
+            options={
+                'unique_together': {('model', 'row_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+from array import array
+
+from django.db import migrations
+from django.db.models import F
+from django.utils import timezone
+
+CHUNK = 500
+
+
+def rebuild_facets(apps, schema_editor):
+    """facets.rebuild with the historical models: the index (FacetLink, FacetPosting) of the existing ProductAttributes"""
+    alias = schema_editor.connection.alias
+    ProductAttributes = apps.get_model('product_api', 'ProductAttributes')
+    FacetLink = apps.get_model('product_api', 'FacetLink')
+    FacetPosting = apps.get_model('product_api', 'FacetPosting')
+    ModelVersion = apps.get_model('product_api', 'ModelVersion')
+
+    FacetLink.objects.using(alias).all().delete()
+    FacetPosting.objects.using(alias).all().delete()
+    links = []
+    products = {}
+    for pk, attribute_id, product_id in ProductAttributes.objects.using(alias).values_list('pk', 'attribute_id', 'product_id').iterator():
+        links.append(FacetLink(id=pk, attribute_id=attribute_id))
+        products.setdefault(attribute_id, set()).add(product_id)
+    FacetLink.objects.using(alias).bulk_create(links, batch_size=CHUNK)
+    FacetPosting.objects.using(alias).bulk_create([FacetPosting(attribute_id=attribute_id, products=array('I', sorted(ids)).tobytes())
+                                                   for attribute_id, ids in products.items()], batch_size=CHUNK)
+    now = timezone.now()   # processes reload their in-memory index (facets.get_index)
+    if not ModelVersion.objects.using(alias).filter(model='facetposting').update(version=F('version') + 1, modified=now):
+        ModelVersion.objects.using(alias).create(model='facetposting', version=1, modified=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0008_change'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.3 on 2026-10-17 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_api', '0009_rebuild_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='change',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, null=True, verbose_name='Modified'),
+        ),
+    ]
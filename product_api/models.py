@@ -1,35 +1,35 @@
 from django.db import models
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .signals import rows_changed
+
+CHUNK = 500   # id's in a single "IN (..)" query (SQLite limits count of variables)
+
+
+def chunks(ids, size=CHUNK):
+    """split the id's for "IN (..)" queries"""
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
 
 class UpdateMixin:
     def update(self, **kwargs):
         if self._state.adding:
             raise self.DoesNotExist
-        dirty = dirty_m2m = False
-        for field, value in kwargs.items():
-            if getattr(self, field) != value:
-                easy = True
-                if type(value) is list:
-                    fld = self._meta.get_field(field)
-                    if isinstance(fld, models.fields.related.ManyToManyField):  # covers m2m, but probably not working for explicit through=.. !!
-                        easy = False
-                        manager = getattr(self, fld.attname)
-                        oldval = manager.all()
-                        if set(oldval) == set(value):
-                            continue   # no change required
-                        manager.set(value, clear=True)
-                        dirty = dirty_m2m = True
-                if easy:  # covers FK + non-relational fields
-                    setattr(self, field, value)
-                    dirty = True
-        if dirty:
-            if dirty_m2m:
-                self.save()
-            else:
-                self.save(update_fields=kwargs.keys())
-            return True  # really updated
-        return False
+        fields, m2m = self.changes(**kwargs)
+        for field, (added, removed) in m2m.items():   # only the changed links, the row itself needn't be saved
+            manager = getattr(self, field)
+            if removed:
+                manager.remove(*removed)
+            if added:
+                manager.add(*added)
+            self.m2m_pks_cache().pop(field, None)
+        if fields:
+            self.save(update_fields=fields)
+        return bool(fields or m2m)  # really updated ?
 
         '''
         ManyToManyField:
@@ -47,6 +47,57 @@ class UpdateMixin:
         u.today_ref_viewed_ips.set(today_ref_objs, clear=True)
         '''
 
+    def changes(self, **kwargs):
+        """compare new values with the current ones (relations by pk's only), nothing is saved (Importer uses this for bulk updates)
+        returns (fields, m2m):
+            fields: names of changed FK + non-relational fields, new values are already set on the instance
+            m2m: {field name: (pk's of added related objects, pk's of removed ones)} for changed ManyToMany fields, nothing is set for them
+        """
+        fields = []
+        m2m = {}
+        for field, value in kwargs.items():
+            fld = self._meta.get_field(field)
+            if fld.many_to_many:   # covers m2m, but probably not working for explicit through=.. !!
+                old = self.m2m_pks(field)
+                new = {obj.pk for obj in value}
+                if old != new:
+                    m2m[field] = (new - old, old - new)
+                continue
+            if fld.is_relation:    # FK: compare pk's, without loading the related object
+                changed = getattr(self, fld.attname) != (value.pk if value is not None else None)
+            else:
+                changed = getattr(self, field) != value
+            if changed:
+                setattr(self, field, value)
+                fields.append(field)
+        return fields, m2m
+
+    def m2m_pks(self, field):
+        """set of pk's of objects related by the ManyToMany field (prefetched by prefetch_m2m_pks or 1 query)"""
+        prefetched = self.m2m_pks_cache()
+        if field in prefetched:
+            return prefetched[field]
+        return set(getattr(self, field).values_list('pk', flat=True))
+
+    def m2m_pks_cache(self):
+        if not hasattr(self, '_m2m_pks'):
+            self._m2m_pks = {}   # {field name: set of pk's}
+        return self._m2m_pks
+
+    @classmethod
+    def prefetch_m2m_pks(cls, rows):
+        """load pk's of related objects of all ManyToMany fields for all rows (1 query per field and CHUNK rows), see m2m_pks"""
+        for fld in cls._meta.many_to_many:
+            Through = fld.remote_field.through
+            source = fld.m2m_column_name()           # catalog_id
+            target = fld.m2m_reverse_name()          # product_id
+            pks = {row.pk: set() for row in rows}
+            for ids in chunks(pks):
+                for source_pk, target_pk in Through.objects.filter(**{source + '__in': ids}).values_list(source, target):
+                    pks[source_pk].add(target_pk)
+            for row in rows:
+                row.m2m_pks_cache()[fld.name] = pks[row.pk]
+
 
 class AttributeName(models.Model, UpdateMixin):
     nazev = models.CharField(max_length=120, verbose_name=_('Name'))
@@ -65,9 +116,18 @@ class AttributeValue(models.Model, UpdateMixin):
 
 
 class Attribute(models.Model, UpdateMixin):
-    nazev_atributu_id = models.ForeignKey(AttributeName, on_delete=models.CASCADE, verbose_name=_('Attribute name'))
+    nazev_atributu_id = models.ForeignKey(AttributeName, on_delete=models.CASCADE, db_index=False,   # see the unique constraint
+                                          verbose_name=_('Attribute name'))
     hodnota_atributu_id = models.ForeignKey(AttributeValue, on_delete=models.CASCADE, verbose_name=_('Attribute value'))
 
+    class Meta:
+        constraints = [   # one row for each pair (name, value); checked by imports in bulk (importer.unique_clashes), not by DRF
+            models.UniqueConstraint(fields=['nazev_atributu_id', 'hodnota_atributu_id'], name='attribute_name_value_unique'),
+        ]
+
+    def __str__(self):   # loads both related rows, use select_related for lists (see admin.py)
+        return '%s: %s' % (self.nazev_atributu_id, self.hodnota_atributu_id)
+
 
 class Product(models.Model, UpdateMixin):
     CURRENCIES = [
@@ -82,19 +142,36 @@ class Product(models.Model, UpdateMixin):
     published_on = models.DateTimeField(null=True, blank=True, verbose_name=_('Published_on'))
     is_published = models.BooleanField(default=False, verbose_name=_('Is published?'))
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_published', 'published_on'], name='product_published_idx'),   # published products by date
+        ]
+
     def __str__(self):
         return self.nazev
 
 
 class ProductAttributes(models.Model, UpdateMixin):
-    attribute = models.ForeignKey(Attribute, on_delete=models.CASCADE, verbose_name=_('Attribute'))
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name=_('Product'))
+    # both FK's are the first columns of the composite indexes below, so they need no index of their own
+    attribute = models.ForeignKey(Attribute, on_delete=models.CASCADE, db_index=False, verbose_name=_('Attribute'))
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False, verbose_name=_('Product'))
+
+    class Meta:
+        constraints = [   # an attribute once for each product (attributes of products, documents.py), see importer.unique_clashes
+            models.UniqueConstraint(fields=['product', 'attribute'], name='product_attribute_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['attribute', 'product'], name='attribute_product_idx'),   # products with the attribute (facets.py), index only
+        ]
 
 
 class Image(models.Model, UpdateMixin):
     nazev = models.CharField(max_length=180, null=True, blank=True, verbose_name=_('Name'))
     obrazek = models.URLField(verbose_name=_('Source URL'))
 
+    def __str__(self):
+        return self.nazev or self.obrazek
+
 
 class ProductImage(models.Model, UpdateMixin):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name=_('Product'))
@@ -110,3 +187,139 @@ class Catalog(models.Model, UpdateMixin):
 
     def __str__(self):
         return self.nazev
+
+
+class ImportJob(models.Model):
+    """import running in the background (POST /import?async=1), see jobs.py"""
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [
+        (QUEUED, QUEUED),
+        (RUNNING, RUNNING),
+        (DONE, DONE),
+        (FAILED, FAILED),
+    ]
+
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED, verbose_name=_('Status'))
+    payload = models.CharField(max_length=255, verbose_name=_('Stored payload'))
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('Created'))
+    finished = models.DateTimeField(null=True, blank=True, verbose_name=_('Finished'))
+    total = models.PositiveIntegerField(default=0, verbose_name=_('Items'))
+    processed = models.PositiveIntegerField(default=0, verbose_name=_('Processed items'))
+    inserted = models.PositiveIntegerField(default=0, verbose_name=_('Inserted'))
+    updated = models.PositiveIntegerField(default=0, verbose_name=_('Updated'))
+    errors = models.TextField(blank=True, verbose_name=_('Errors (json)'))
+
+    def __str__(self):
+        return '%s %s' % (self.pk, self.status)
+
+
+class ModelVersion(models.Model):
+    """change counter of each model, increased with each change of its rows (ETag/Last-Modified of the views)"""
+    model = models.CharField(max_length=100, unique=True, verbose_name=_('Model'))
+    version = models.BigIntegerField(default=0, verbose_name=_('Version'))
+    modified = models.DateTimeField(null=True, blank=True, verbose_name=_('Modified'))
+
+    def __str__(self):
+        return '%s %s' % (self.model, self.version)
+
+    @classmethod
+    def bump(cls, model):
+        now = timezone.now()
+        if not cls.objects.filter(model=model).update(version=models.F('version') + 1, modified=now):
+            cls.objects.create(model=model, version=1, modified=now)
+
+    @classmethod
+    def get(cls, model):
+        """(version, modified) of the model, (0, None) if it was never changed"""
+        return cls.objects.filter(model=model).values_list('version', 'modified').first() or (0, None)
+
+    @classmethod
+    def get_combined(cls, names):
+        """(version, modified) of data depending on more models: sum of versions (it increases with any change), latest modification"""
+        rows = list(cls.objects.filter(model__in=names).values_list('version', 'modified'))
+        return sum(version for version, _modified in rows), max((modified for _version, modified in rows if modified), default=None)
+
+
+@receiver(rows_changed)
+def bump_version(sender, **kwargs):
+    ModelVersion.bump(sender._meta.model_name)
+
+
+class FacetLink(models.Model):
+    """copy of ProductAttributes.attribute (id = ProductAttributes.id), to know which postings change if the row changes, see facets.py"""
+    id = models.IntegerField(primary_key=True, verbose_name=_('Product attribute'))
+    attribute_id = models.IntegerField(db_index=True, verbose_name=_('Attribute'))
+
+
+class FacetPosting(models.Model):
+    """inverted index of products by attribute (name + value), see facets.py"""
+    attribute_id = models.IntegerField(unique=True, verbose_name=_('Attribute'))
+    products = models.BinaryField(verbose_name=_('Products (sorted array of uint32)'))
+
+
+class ImportFingerprint(models.Model):
+    """hash of the values of the row from its last import, unchanged rows are skipped by the next import, see fingerprints.py"""
+    model = models.CharField(max_length=100, verbose_name=_('Model'))
+    row_id = models.IntegerField(verbose_name=_('Row'))
+    digest = models.CharField(max_length=32, verbose_name=_('Digest'))
+
+    class Meta:
+        unique_together = [('model', 'row_id')]
+
+
+class ImportDigest(models.Model):
+    """hash of a whole import payload with its results, valid until the data change (version: see ModelVersion), see fingerprints.py"""
+    digest = models.CharField(max_length=32, unique=True, verbose_name=_('Digest'))
+    version = models.BigIntegerField(verbose_name=_('Version of the data'))
+    results = models.TextField(verbose_name=_('Results (json)'))
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('Created'))
+
+
+class ImportCheckpoint(models.Model):
+    """items of a payload already committed by a failed or interrupted import (FAILURE_RESUME), the same payload is resumed from there
+    the position is saved in the transaction of each chunk (see Importer.commit_chunk)
+    """
+    digest = models.CharField(max_length=32, unique=True, verbose_name=_('Digest of the payload'))
+    position = models.BigIntegerField(verbose_name=_('Committed items'))
+    modified = models.DateTimeField(auto_now=True, verbose_name=_('Modified'))
+
+    @classmethod
+    def get(cls, digest):
+        """count of items committed by an earlier import of the payload"""
+        if digest is None:
+            return 0
+        return cls.objects.filter(digest=digest).values_list('position', flat=True).first() or 0
+
+    @classmethod
+    def save_position(cls, digest, position):
+        if digest is not None:
+            cls.objects.update_or_create(digest=digest, defaults={'position': position})
+
+    @classmethod
+    def clear(cls, digest):
+        if digest is not None:
+            cls.objects.filter(digest=digest).delete()
+
+
+class Change(models.Model):
+    """the last change of a row of the product models (inserted, updated, deleted, changed m2m links), see changes.py
+    each change gets a new seq (and the older record of the row is deleted), so the feed has each row only once
+    """
+    seq = models.BigAutoField(primary_key=True, verbose_name=_('Sequence'))
+    model = models.CharField(max_length=100, verbose_name=_('Model'))
+    row_id = models.IntegerField(verbose_name=_('Row'))
+    modified = models.DateTimeField(auto_now=True, null=True, verbose_name=_('Modified'))
+
+    class Meta:
+        unique_together = [('model', 'row_id')]
+
+    @classmethod
+    def stamps(cls, model, pks):
+        """{pk: (seq, modified)} of the last change of the rows (version of a single row: Detail cache and ETag),
+        (0, None) if the row was never changed since the change feed exists
+        """
+        stamps = dict.fromkeys(pks, (0, None))
+        for pks_chunk in chunks(stamps):
+            for pk, seq, modified in cls.objects.filter(model=model, row_id__in=pks_chunk).values_list('row_id', 'seq', 'modified'):
+                stamps[pk] = (seq, modified)
+        return stamps
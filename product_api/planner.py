@@ -0,0 +1,81 @@
+"""import plan: order of the models and the rows of a payload
+
+    import_order(models) : {Model: position}, derived from FK/ManyToMany fields, so each model is imported after the models
+        it references (their rows must exist before the referencing rows are validated and written)
+    Plan : rows of the payload, repeated (model, id) items merged in a single pass (the earlier item wins), so each row
+        gets 1 serializer, however many times it is repeated; POST /import?plan=1 returns Plan.describe()
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+
+def dependencies(Model, models):
+    """models (of the given ones) referenced by FK/OneToOne/ManyToMany fields of the Model"""
+    return {field.related_model for field in Model._meta.get_fields()
+            if field.concrete and (field.many_to_one or field.one_to_one or field.many_to_many)
+            and field.related_model in models and field.related_model is not Model}
+
+
+def import_order(models):
+    """{Model: position} in the topological order of FK/ManyToMany dependencies; each step takes the first ready model
+    of the given order, so the given order is kept where the dependencies allow it
+    """
+    models = list(models)
+    waiting = {Model: dependencies(Model, models) for Model in models}
+    order = {}
+    while waiting:
+        ready = next((Model for Model in models if Model in waiting and not waiting[Model] - order.keys()), None)
+        if ready is None:
+            raise ImproperlyConfigured('models with cyclic FK/ManyToMany dependencies cannot be imported: %s'
+                                       % ', '.join(Model.__name__ for Model in waiting))
+        order[ready] = len(order)
+        del waiting[ready]
+    return order
+
+
+class Plan:
+    """rows of a payload: (Model, pk) -> merged values, in the import order
+
+        plan = Plan()
+        for Model, Serializer, import_order, pk, values in staged:   # see Importer.check_item
+            plan.add(Model, Serializer, import_order, pk, values)
+        plan.rows()   # [(Model, Serializer, import_order, pk, values)], 1 per (Model, pk)
+    """
+    def __init__(self):
+        self.items = 0
+        self.merged = {}   # {(Model, pk): [Serializer, import_order, values, count of items]}
+
+    def add(self, Model, Serializer, import_order, pk, values):
+        self.items += 1
+        key = (Model, pk)
+        row = self.merged.get(key)
+        if row is None:
+            self.merged[key] = [Serializer, import_order, values, 1]
+            return
+        if row[3] == 1:
+            row[2] = dict(row[2])   # don't change the item of the payload
+        merged = row[2]
+        for name, value in values.items():   # the earlier item wins, only new keys are added
+            if name not in merged:
+                merged[name] = value
+        row[3] += 1
+
+    def rows(self):
+        """(Model, Serializer, import_order, pk, values) of each row, by import order (and the first occurrence in the payload)"""
+        rows = [(Model, Serializer, import_order, pk, values) for (Model, pk), (Serializer, import_order, values, _count) in self.merged.items()]
+        rows.sort(key=lambda row: row[2])   # stable
+        return rows
+
+    def describe(self):
+        """the plan for inspection: models in the import order with their dependencies, counts of items and rows"""
+        staged = {Model for Model, _pk in self.merged}
+        models = {}   # {import_order: description}
+        for (Model, _pk), (_Serializer, import_order, _values, count) in self.merged.items():
+            model = models.get(import_order)
+            if model is None:
+                depends_on = sorted(Related._meta.model_name for Related in dependencies(Model, staged))
+                model = models[import_order] = {'model': Model._meta.model_name, 'order': import_order,
+                                                'depends_on': depends_on, 'items': 0, 'rows': 0}
+            model['items'] += count
+            model['rows'] += 1
+        return {'items': self.items, 'rows': len(self.merged), 'merged': self.items - len(self.merged),
+                'models': [models[import_order] for import_order in sorted(models)]}
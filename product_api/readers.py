@@ -0,0 +1,95 @@
+"""read serializers: the same output as serializers.py (DRF), but without DRF field machinery per row
+
+A ReadSerializer is compiled once per model of MODELSWITCH (at startup, see apps.py) from the fields of its DRF serializer:
+simple fields are copied from .values() dicts, FK's give the id (attname column), Decimal/DateTime/Choice fields use
+to_representation of the (once created) DRF field, ManyToMany fields are pk lists read from the through table.
+"""
+from rest_framework import fields as drf_fields
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+
+from .models import chunks
+
+IDENTITY_FIELDS = (drf_fields.IntegerField, drf_fields.CharField, drf_fields.BooleanField)   # values from the database need no conversion
+
+_readers = {}   # {model name: ReadSerializer}
+
+
+class ReadSerializer:
+    """serialize rows of the model, as Serializer(row).data would do
+
+        reader = get_reader(Model)
+        reader.rows([1, 2, 3])   # {pk: data} of existing rows, 1 query (+ 1 per ManyToMany field)
+        reader.data(row)         # data of a model instance
+    """
+    def __init__(self, Serializer):
+        self.Model = Model = Serializer.Meta.model
+        self.fields = []    # [(name, column of .values() or None for ManyToMany, conversion or None)]
+        self.columns = []
+        self.m2m = []       # [(name, through model, source column, target column)]
+        for name, field in Serializer().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, ManyRelatedField):
+                fld = Model._meta.get_field(field.source)
+                self.m2m.append((name, fld.remote_field.through, fld.m2m_column_name(), fld.m2m_reverse_name()))
+                self.fields.append((name, None, None))
+                continue
+            fld = Model._meta.get_field(field.source)
+            if isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None:
+                convert = None   # FK id
+            elif type(field) in IDENTITY_FIELDS:
+                convert = None
+            else:
+                convert = field.to_representation
+            self.fields.append((name, fld.attname, convert))
+            self.columns.append(fld.attname)
+
+    def represent(self, values, m2m=None):
+        """data from .values() dict of the row and {ManyToMany field: [pk's]}"""
+        data = {}
+        for name, column, convert in self.fields:
+            if column is None:
+                data[name] = m2m[name]
+            else:
+                value = values[column]
+                data[name] = value if convert is None or value is None else convert(value)
+        return data
+
+    def rows(self, pks):
+        """{pk: data} of existing rows with the pk's; 1 query for CHUNK rows + 1 query for each ManyToMany field"""
+        found = {}
+        pk_column = self.Model._meta.pk.attname
+        for pks_chunk in chunks(pks):
+            rows = list(self.Model.objects.filter(pk__in=pks_chunk).values(*self.columns))
+            links = self.links([values[pk_column] for values in rows])
+            for values in rows:
+                pk = values[pk_column]
+                found[pk] = self.represent(values, {name: related[pk] for name, related in links.items()})
+        return found
+
+    def links(self, pks):
+        """{ManyToMany field: {pk: [related pk's]}}, ordered by the related pk's; 1 query for CHUNK pk's per field"""
+        links = {}
+        for name, Through, source, target in self.m2m:
+            related = links[name] = {pk: [] for pk in pks}
+            for pks_chunk in chunks(related):
+                for source_pk, target_pk in Through.objects.filter(**{source + '__in': pks_chunk}).order_by(source, target).values_list(source, target):
+                    related[source_pk].append(target_pk)
+        return links
+
+    def data(self, row):
+        """data of a model instance (ManyToMany pk's are read by 1 query per field, unless they are prefetched)"""
+        values = {column: getattr(row, column) for column in self.columns}
+        m2m = {name: [obj.pk for obj in getattr(row, name).all()] for name, _Through, _source, _target in self.m2m}
+        return self.represent(values, m2m)
+
+
+def compile_readers():
+    from .importer import MODELSWITCH
+    for _Model, Serializer, _import_order in MODELSWITCH.values():
+        reader = ReadSerializer(Serializer)
+        _readers[reader.Model._meta.model_name] = reader
+
+
+def get_reader(Model):
+    return _readers[Model._meta.model_name]
@@ -0,0 +1,126 @@
+"""id registry of an import: which rows exist, so FK/ManyToMany values are validated without 1 query per reference
+
+IdRegistry knows pk's of rows staged in the payload (they will be written before the rows referencing them, see import order)
+and pk's found in the database, which are loaded in bulk (load_references) before a group of items is validated.
+Serializers get it in their context (context={'registry': registry}); their related fields (serializers.AbstractSerializer
+uses RegistryPrimaryKeyRelatedField) check pk's in it and return Model(pk=pk) instead of loading the object.
+Without a registry in the context, they work as the standard DRF fields.
+"""
+from django.core.exceptions import ValidationError as DjangoValidationError
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+
+from .models import chunks
+
+
+class IdRegistry:
+    def __init__(self):
+        self.known = {}     # {Model: pk's of rows which exist or are staged}
+        self.missing = {}   # {Model: pk's of rows which don't exist (checked in the database, or failed staged rows)}
+
+    def stage(self, Model, pks):
+        """rows of the payload (written before the rows which reference them)"""
+        self.known.setdefault(Model, set()).update(pks)
+        self.missing.get(Model, set()).difference_update(pks)
+
+    def discard(self, Model, pks):
+        """staged rows which will not be written (not valid, failed write, ..)"""
+        self.known.get(Model, set()).difference_update(pks)
+        self.missing.setdefault(Model, set()).update(pks)
+
+    def exists(self, Model, pk):
+        if pk in self.known.get(Model, ()):
+            return True
+        if pk not in self.missing.get(Model, ()):
+            self.load(Model, [pk])   # not loaded by load_references (values not in initial_data, ..)
+        return pk in self.known.get(Model, ())
+
+    def load(self, Model, pks):
+        """check which of the pk's (not known yet) exist in the database, 1 query per CHUNK pk's"""
+        known = self.known.setdefault(Model, set())
+        missing = self.missing.setdefault(Model, set())
+        unknown = set(pks) - known - missing
+        for pks_chunk in chunks(unknown):
+            found = set(Model.objects.filter(pk__in=pks_chunk).values_list('pk', flat=True))
+            known.update(found)
+            missing.update(set(pks_chunk) - found)
+
+    def load_references(self, serializers):
+        """load existence of all rows referenced by FK/ManyToMany values of the serializers (before they are validated)"""
+        references = {}   # {Model: pk's}
+        relations = {}    # {Serializer class: [(field name, related Model, many)]}
+        for serializer in serializers:
+            fields = relations.get(type(serializer))
+            if fields is None:
+                fields = relations[type(serializer)] = related_fields(serializer)
+            for name, Related, many in fields:
+                value = serializer.initial_data.get(name)
+                if value is None:
+                    continue
+                pks = references.setdefault(Related, set())
+                for pk in (value if many and isinstance(value, (list, tuple)) else [value]):
+                    try:
+                        pks.add(Related._meta.pk.to_python(pk))
+                    except (TypeError, ValueError, DjangoValidationError):   # the field reports it
+                        pass
+        for Related, pks in references.items():
+            self.load(Related, pks)
+
+
+def related_fields(serializer):
+    fields = []
+    for name, field in serializer.fields.items():
+        if field.read_only:
+            continue
+        many = isinstance(field, ManyRelatedField)
+        if many:
+            field = field.child_relation
+        if isinstance(field, RelatedField) and field.queryset is not None:
+            fields.append((name, field.queryset.model, many))
+    return fields
+
+
+class RegistryPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField which checks the pk in the IdRegistry of the context (no query), returns Model(pk=pk)"""
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return RegistryManyRelatedField(**list_kwargs)
+
+    def to_internal_value(self, data):
+        registry = self.context.get('registry')
+        if registry is None:
+            return super().to_internal_value(data)
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        Model = self.get_queryset().model
+        try:
+            pk = Model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if not registry.exists(Model, pk):
+            self.fail('does_not_exist', pk_value=data)
+        return Model(pk=pk)
+
+
+class RegistryManyRelatedField(ManyRelatedField):
+    """ManyRelatedField which reports all wrong pk's of the list, not only the first one"""
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        objects = []
+        errors = []
+        for item in data:
+            try:
+                objects.append(self.child_relation.to_internal_value(item))
+            except ValidationError as exc:
+                errors.extend(exc.detail)
+        if errors:
+            raise ValidationError(errors)
+        return objects
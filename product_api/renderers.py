@@ -0,0 +1,94 @@
+"""fast renderers and parsers, selected by content negotiation (Accept / Content-Type header, or ?format=json|msgpack)
+
+    JSONRenderer, JSONParser : orjson, if installed (pip install orjson), otherwise the standard DRF ones;
+        the output is the same as from DRF (compact, unicode, the same handling of Decimal, datetime, ..)
+    MessagePackRenderer, MessagePackParser : application/msgpack, only if msgpack is installed (pip install msgpack);
+        values are the same as in JSON (Decimal and datetime as strings in the format of DRF)
+"""
+from django.conf import settings
+
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+encode_default = JSONEncoder().default   # DRF handling of types which aren't JSON (Decimal, datetime, lazy texts, ..)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """DRF JSONRenderer using orjson; indented output (browsable API) and non-default JSON settings use the DRF one
+    (NaN and Infinity floats are rendered as null instead of an error)
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with metrics.phase('render'):
+            return self.render_json(data, accepted_media_type, renderer_context)
+
+    def render_json(self, data, accepted_media_type, renderer_context):
+        if (orjson is None or data is None or not self.compact or self.ensure_ascii
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=encode_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:   # ie. integers out of 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        # the same escaping as DRF: JSON output must be a strict javascript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class JSONParser(parsers.JSONParser):
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read() if stream is not None else b'')
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % exc)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with metrics.phase('render'):
+            return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class MessagePackParser(parsers.BaseParser):
+    media_type = MSGPACK_MEDIA_TYPE
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read() if stream is not None else b'', raw=False, strict_map_key=False)
+        except (ValueError, TypeError) as exc:   # msgpack errors are ValueError's, TypeError for unhashable keys
+            raise ParseError('MessagePack parse error - %s' % exc)
+
+
+# for renderer_classes and parser_classes of the views
+RENDERER_CLASSES = [JSONRenderer] + [cls for cls in api_settings.DEFAULT_RENDERER_CLASSES if cls is not renderers.JSONRenderer]
+PARSER_CLASSES = [JSONParser] + [cls for cls in api_settings.DEFAULT_PARSER_CLASSES if cls is not parsers.JSONParser]
+if msgpack is not None:
+    RENDERER_CLASSES.append(MessagePackRenderer)
+    PARSER_CLASSES.append(MessagePackParser)
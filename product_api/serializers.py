@@ -1,23 +1,23 @@
 from rest_framework import serializers
 
 from . import models
+from .registry import RegistryPrimaryKeyRelatedField
 
 
 class AbstractSerializer(serializers.ModelSerializer):
     # id = serializers.IntegerField()
     list_fields = ['id']
+    serializer_related_field = RegistryPrimaryKeyRelatedField   # FK/m2m pk's checked in the IdRegistry of imports (see registry.py)
 
     def __init__(self, *args, **kwargs):
-        as_list = kwargs.pop('as_list', False)
+        self.as_list = kwargs.pop('as_list', False)
         super().__init__(*args, **kwargs)
-        if as_list:
-            # self.fields = self.list_fields : not possible to do, because self.fields has more info inside
-            exclude = []
-            for fld in self.fields:
-                if fld not in self.list_fields:
-                    exclude.append(fld)  # to be sure, we avoid deletion during the cycle over same dict ..
-            for fld in exclude:          # .. and do it in separate step
-                del self.fields[fld]
+
+    def get_field_names(self, declared_fields, info):
+        names = super().get_field_names(declared_fields, info)
+        if self.as_list:   # only list_fields are built (not all fields built and then deleted)
+            names = [name for name in names if name in self.list_fields]
+        return names
 
 
 class AttributeNameSerializer(AbstractSerializer):
@@ -0,0 +1,49 @@
+"""rows_changed: a single signal for all changes of the product models, no matter how they were done
+
+Importer sends it for its bulk writes (bulk_create/bulk_update/m2m through rows don't send any model signals),
+other writes (admin, UpdateMixin.update, ..) are translated from post_save, post_delete and m2m_changed
+(+ pre_delete of related rows: the delete removes m2m links to them without any signal).
+Receivers (caches, ..) get sender=Model, pks=[changed id's] (inserted, updated, deleted, or with changed m2m links).
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal
+
+rows_changed = Signal(providing_args=['pks'])
+
+_links = {}   # {related Model: [(Model with ManyToMany field to it, through model, source column, target column)]}
+
+
+def connect(models):
+    """translate model signals of the models into rows_changed"""
+    for Model in models:
+        post_save.connect(saved, sender=Model)
+        post_delete.connect(saved, sender=Model)
+        for fld in Model._meta.many_to_many:
+            m2m_changed.connect(m2m_saved, sender=fld.remote_field.through)
+            _links.setdefault(fld.related_model, []).append((Model, fld.remote_field.through, fld.m2m_column_name(), fld.m2m_reverse_name()))
+            pre_delete.connect(linked_deleted, sender=fld.related_model)
+
+
+def saved(sender, instance, **kwargs):
+    rows_changed.send(sender=sender, pks=[instance.pk])
+
+
+def m2m_saved(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not reverse:     # catalog.products_ids.add(..): the catalog has changed
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            rows_changed.send(sender=type(instance), pks=[instance.pk])
+    elif action in ('post_add', 'post_remove'):   # product.catalogs.add(..): catalogs in pk_set have changed
+        rows_changed.send(sender=model, pks=list(pk_set))
+    elif action == 'pre_clear':                   # product.catalogs.clear(): all its catalogs will change
+        source = [fld for fld in sender._meta.fields if fld.is_relation and fld.related_model is type(instance)][0]
+        target = [fld for fld in sender._meta.fields if fld.is_relation and fld.related_model is model][0]
+        pks = sender.objects.filter(**{source.attname: instance.pk}).values_list(target.attname, flat=True)
+        rows_changed.send(sender=model, pks=list(pks))
+
+
+def linked_deleted(sender, instance, **kwargs):
+    """a related row (product, attribute) will be deleted: rows with ManyToMany links to it (catalogs) will change"""
+    for Model, Through, source, target in _links.get(sender, ()):
+        pks = list(Through.objects.filter(**{target: instance.pk}).values_list(source, flat=True))
+        if pks:
+            rows_changed.send(sender=Model, pks=pks)
@@ -0,0 +1,203 @@
+import codecs
+import json
+import tempfile
+
+from django.db import transaction
+
+from . import fingerprints
+from .importer import FAILURE_RESUME, FAILURE_REVERT, Importer, ModelSwitch
+from .models import ImportCheckpoint
+
+CHUNK_SIZE = 64 * 1024           # bytes read from the request at once
+MAX_ITEM_SIZE = 16 * 1024 * 1024  # longer item is an error (otherwise broken json would make us read everything into memory)
+BATCH_SIZE = 2000                # items staged + validated + written at once
+
+
+def iter_items(stream, chunk_size=CHUNK_SIZE):
+    """yield items one by one from a binary stream with a JSON array ([{..}, {..}]) or NDJSON (1 item per line)
+    raises ValueError if the stream isn't valid
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def more():
+        nonlocal buf, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+        if len(buf) > MAX_ITEM_SIZE:
+            raise ValueError('item is too long or JSON is not valid, near: %s' % buf[:80])
+
+    def next_char():   # skips whitespace, '' at the end of the stream
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            more()
+
+    array = next_char() == '['   # otherwise NDJSON
+    if array:
+        pos += 1
+        separated = True   # item can follow
+    while True:
+        char = next_char()
+        if array:
+            if char == ']':
+                pos += 1
+                if next_char():
+                    raise ValueError('unexpected data after the end of JSON array')
+                return
+            if char == ',' and not separated:
+                pos += 1
+                separated = True
+                continue
+            if not char:
+                raise ValueError('unexpected end of JSON array')
+            if not separated:
+                raise ValueError("',' expected between items of JSON array, near: %s" % buf[pos:pos + 80])
+            separated = False
+        elif not char:
+            return
+
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError('JSON is not valid, near: %s' % buf[pos:pos + 80])
+                more()
+                continue
+            if end == len(buf) and not eof:   # value could continue (number split between chunks)
+                more()
+                continue
+            break
+        pos = end
+        yield item
+
+
+class StreamImporter(Importer):
+    """Importer for huge payloads, items are read from a stream (see iter_items) instead of a list in memory
+
+    Checked items are spooled into a temporary file per model. Then the models are processed in the import order
+    and each of them in batches of about batch_size items (staged, validated and written like in Importer, all in 1 transaction).
+    Large models are split into batches by id, so repeated id's are always in the same batch and merged as in Importer.
+    Memory doesn't depend on the payload size.
+    With FAILURE_RESUME each batch is committed in its own transaction (see Importer.run_chunks).
+
+    Rows of a model split into more batches are written batch by batch (id % count of batches), not in the payload order,
+    so with FAILURE_STOP the rows written before the 1st error are the valid rows of the batches before the failed one and
+    the rows before the error in its batch, which are not the same rows as Importer writes (up to the error in the payload).
+    FAILURE_REVERT (the default of /import/stream) writes nothing in both cases; models up to batch_size items are the same.
+    """
+    def __init__(self, failure_mode=None, batch_size=BATCH_SIZE):
+        super().__init__(failure_mode)
+        self.batch_size = batch_size
+        self.spool = {}   # {import_order: [model name, temporary file (json lines: [pk, values]), count of items]}
+        self.total = self.processed = 0   # spooled items, items already validated + written
+
+    def progress(self):
+        """called after each batch, for subclasses which need to report the progress"""
+
+    def stage(self, stream):
+        """check the items and spool them per model (raises ValueError if the stream isn't valid JSON/NDJSON)"""
+        stream = HashingReader(stream, fingerprints.payload_hash(self.failure_mode))
+        for i, item in enumerate(iter_items(stream)):
+            checked = self.check_item(i, item)
+            if checked:
+                Model, _Serializer, import_order, pk, values = checked
+                spooled = self.spool.get(import_order)
+                if spooled is None:
+                    spooled = self.spool[import_order] = [Model._meta.model_name, spool_file(), 0]
+                spooled[1].write(json.dumps([pk, values]) + '\n')
+                spooled[2] += 1
+                self.total += 1
+        self.digest = stream.hash.hexdigest()
+
+    def run(self):
+        """validate and write the spooled items, model by model in the import order (FK dependencies), in batches"""
+        try:
+            if self.errors:
+                return
+            if self.failure_mode == FAILURE_RESUME:
+                self.run_chunks()
+                return
+            with transaction.atomic():
+                for import_order in sorted(self.spool):
+                    for batch in self.batches(*self.spool[import_order]):
+                        self.updates = []
+                        self.prepare(batch)
+                        self.write_group(self.updates)
+                        self.processed += len(batch)
+                        self.progress()
+                if self.failure_mode == FAILURE_REVERT and self.failed:
+                    raise RuntimeError  # break+revert transaction
+        except RuntimeError as exc:     # this is just to continue after transaction is reverted
+            self.inserted = self.updated = 0
+        except transaction.TransactionManagementError as exc:
+            self.inserted = self.updated = 0
+            self.add_error("+ transaction.TransactionManagementError (more SQL commands after Rollback)")
+        finally:
+            self.updates = []
+            for _model, spooled, _count in self.spool.values():
+                spooled.close()
+
+    def run_chunks(self):
+        """FAILURE_RESUME: batches are committed one by one, batches committed by an earlier import of the same payload are skipped"""
+        done = ImportCheckpoint.get(self.digest)
+        for import_order in sorted(self.spool):
+            for batch in self.batches(*self.spool[import_order]):
+                start = self.processed
+                self.processed += len(batch)
+                if self.processed > done:
+                    self.updates = []
+                    self.prepare(batch)
+                    if not self.commit_chunk(self.updates, start, self.processed):
+                        return
+                self.progress()
+        ImportCheckpoint.clear(self.digest)
+
+    def batches(self, model, spooled, count):
+        """yield lists of staged items (as expected by Importer.prepare) of about self.batch_size items"""
+        Model, Serializer, import_order = ModelSwitch.classes(model)
+        parts = -(-count // self.batch_size)   # ceil
+        spooled.seek(0)
+        if parts > 1:   # split by id, the same id goes into the same part
+            files = [spool_file() for part in range(parts)]
+            for line in spooled:
+                files[json.loads(line)[0] % parts].write(line)
+        else:
+            files = [spooled]
+        try:
+            for part in files:
+                part.seek(0)
+                batch = []
+                for line in part:
+                    pk, values = json.loads(line)
+                    batch.append((Model, Serializer, import_order, pk, values))
+                yield batch
+        finally:
+            if parts > 1:
+                for part in files:
+                    part.close()
+
+
+class HashingReader:
+    """binary stream which computes the hash of the data read from it"""
+    def __init__(self, stream, hash):
+        self.stream = stream
+        self.hash = hash
+
+    def read(self, *size):   # read() without a size: LimitedStream of Django doesn't accept -1
+        data = self.stream.read(*size)
+        self.hash.update(data)
+        return data
+
+
+def spool_file():
+    return tempfile.TemporaryFile(mode='w+', encoding='utf-8')
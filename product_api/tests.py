@@ -1,3 +1,814 @@
-from django.test import TestCase
+import datetime
+import decimal
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import warnings
+from collections import OrderedDict
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import DatabaseError, connection, router, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.renderers import JSONRenderer
+
+from . import export, facets, jobs, metrics
+from .benchmark import generate, generate_catalogs
+from .cache import get_cache
+from .db import use_primary
+from .importer import FAILURE_RESUME, FAILURE_REVERT, FAILURE_STOP, MODELSWITCH, Importer
+from .models import Attribute, Catalog, Change, FacetLink, FacetPosting, Image, ImportCheckpoint, ImportDigest, ImportJob, Product, ProductAttributes
+from .planner import Plan, dependencies
+from .readers import get_reader
+from .renderers import JSONRenderer as FastJSONRenderer, msgpack
+from .streaming import StreamImporter, iter_items
+from .validation import DryRunImporter
+
+TEST_DATA = os.path.join(settings.BASE_DIR, 'zadani', 'django-assignment', 'test_data.json')
+
+
+class ReadSerializerTest(TestCase):
+    """readers.py must give exactly the same output as the DRF serializers"""
+    @classmethod
+    def setUpTestData(cls):
+        with open(TEST_DATA, encoding='utf-8') as f:
+            importer = Importer()
+            importer.stage(json.load(f))
+            importer.run()
+        Product.objects.create(id=100, nazev='x', description='', cena='0.5', mena='EUR', published_on='2020-02-29T13:45:01.123456Z', is_published=True)
+        catalog = Catalog.objects.create(id=100, nazev='unordered links', obrazek_id=Image.objects.get(pk=1))
+        catalog.products_ids.add(100)
+        catalog.products_ids.add(5, 1)
+
+    def test_same_output(self):
+        render = JSONRenderer().render
+        for Model, Serializer, _import_order in MODELSWITCH.values():
+            rows = Model.objects.order_by('pk')
+            self.assertTrue(rows, Model.__name__)
+            reader = get_reader(Model)
+            read = reader.rows([row.pk for row in rows])
+            for row in rows:
+                expected = render(Serializer(row).data)
+                self.assertEqual(render(read[row.pk]), expected, '%s %s' % (Model.__name__, row.pk))
+                self.assertEqual(render(reader.data(row)), expected, '%s %s' % (Model.__name__, row.pk))
+
+    def test_missing_rows(self):
+        self.assertEqual(get_reader(Product).rows([1, 999]).keys(), {1})
+
+
+class RendererTest(TestCase):
+    """renderers.py must give the same output as the DRF renderers"""
+    def test_json(self):
+        data = [OrderedDict([('cena', decimal.Decimal('21566.00')), ('text', _('Name')), ('line', 'a\u2028b\u2029ž')]),
+                {1: datetime.datetime(2018, 1, 15, 10, 5, 1, 123456, tzinfo=timezone.utc), 'naive': datetime.datetime(2018, 1, 15)},
+                {'date': datetime.date(2018, 1, 15), 'float': 0.1, 'list': (1, None, True)}]
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'), JSONRenderer().render(data, 'application/json; indent=4'))
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        with open(TEST_DATA, encoding='utf-8') as f:
+            data = json.load(f)
+        response = self.client.post('/import', msgpack.packb(data), content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        for url in ('/detail/product/2', '/detail/catalog/1', '/detail/product/?ids=1,2'):
+            as_json = self.client.get(url, HTTP_ACCEPT='application/json')
+            as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(as_msgpack.content), json.loads(as_json.content.decode()))
+
+
+class BenchmarkFeedTest(TestCase):
+    """synthetic feeds of benchmark.py must be valid imports"""
+    def test_import(self):
+        feed = generate(items=500)
+        self.assertEqual(feed, generate(items=500))   # reproducible
+        importer = Importer()
+        importer.stage(feed)
+        importer.run()
+        self.assertEqual(importer.results, {'inserted': len(feed), 'updated': 0})
+
+        products = Product.objects.count()
+        for update in (generate(items=500, revision=1), generate_catalogs(products, revision=2)):
+            importer = Importer()
+            importer.stage(update)
+            importer.run()
+            self.assertEqual(importer.results['inserted'], 0)
+            self.assertNotIn('errors', importer.results)
+        self.assertEqual(Product.objects.get(pk=1).nazev, 'product 1 (1)')
+        self.assertEqual(Catalog.objects.get(pk=1).products_ids.count(), min(100, products))
+
+
+class BenchmarkCommandTest(SimpleTestCase):
+    """manage.py benchmark runs in its own test databases (all aliases, the read alias too)"""
+    def test_command(self):
+        result = subprocess.run([sys.executable, 'manage.py', 'benchmark', '--items', '300', '--requests', '10', '--no-memory'],
+                                cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=300)
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        report = json.loads(result.stdout)
+        for scenario in report['scenarios']:
+            self.assertNotIn('errors', scenario, scenario['name'])
+            self.assertTrue(all(status < 400 for status in scenario['status']), scenario['name'])
+
+
+class ChangesTest(TestCase):
+    """GET /changes : each changed row once, in the order of its last change"""
+    def test_changes(self):
+        with open(TEST_DATA, 'rb') as f:
+            self.assertEqual(self.client.post('/import', f.read(), content_type='application/json').status_code, 201)
+        feed = self.client.get('/changes?limit=100').json()
+        self.assertEqual(len(feed), 91)
+        self.assertEqual([change['seq'] for change in feed], sorted(change['seq'] for change in feed))
+        since = feed[-1]['seq']
+
+        Product.objects.get(pk=2).update(nazev='changed')
+        catalogs = set(Catalog.objects.filter(products_ids=4).values_list('pk', flat=True))
+        Product.objects.get(pk=4).delete()   # removes links of catalogs without m2m signals
+        Product.objects.get(pk=2).update(nazev='changed again')
+        feed = self.client.get('/changes?since=%s&model=product&model=catalog&payload=1' % since).json()
+        self.assertTrue(catalogs)
+        self.assertEqual([(change['model'], change['id']) for change in feed],
+                         [('catalog', pk) for pk in sorted(catalogs)] + [('product', 4), ('product', 2)])
+        self.assertTrue(feed[-2]['deleted'])
+        self.assertNotIn(4, feed[0]['data']['products_ids'])
+        self.assertEqual(feed[-1]['data']['nazev'], 'changed again')
+        self.assertEqual(Change.objects.filter(model='product', row_id=2).count(), 1)
+
+        response = self.client.get('/changes?since=%s&limit=1' % since)
+        self.assertIn('since=%s' % response.json()[0]['seq'], response['Link'])
+
+
+class ExportTest(TestCase):
+    """GET /export gives the data in the format of /import"""
+    def test_round_trip(self):
+        with open(TEST_DATA, 'rb') as f:
+            self.assertEqual(self.client.post('/import', f.read(), content_type='application/json').status_code, 201)
+        response = self.client.get('/export')
+        self.assertEqual(response['X-Changes-Since'], str(Change.objects.order_by('-seq').first().seq))
+        exported = b''.join(response.streaming_content)
+        self.assertEqual(len(json.loads(exported.decode())), 91)
+        ndjson = b''.join(self.client.get('/export?ndjson=1').streaming_content)
+        self.assertEqual([json.loads(line) for line in ndjson.decode().splitlines()], json.loads(exported.decode()))
+
+        for Model, _Serializer, _import_order in sorted(MODELSWITCH.values(), key=lambda item: -item[2]):
+            Model.objects.all().delete()
+        self.assertEqual(self.client.post('/import/stream', ndjson, content_type='application/x-ndjson').status_code, 201)
+        self.assertEqual(b''.join(self.client.get('/export').streaming_content), exported)
+
+        catalogs = json.loads(b''.join(self.client.get('/export?model=catalog').streaming_content).decode())
+        self.assertEqual([list(item) for item in catalogs], [['Catalog']] * Catalog.objects.count())
+        self.assertEqual(self.client.get('/export?model=foo').status_code, 400)
+
+    def test_link_chunks(self):
+        image = Image.objects.create(obrazek='https://images.example.com/1.jpg')
+        Catalog.objects.bulk_create([Catalog(id=pk, nazev='c', obrazek_id=image) for pk in range(1, 1201)])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(list(export.iter_items([Catalog]))), 1200)
+        tables = ['FROM "%s"' % field.remote_field.through._meta.db_table for field in Catalog._meta.many_to_many]
+        links = [query['sql'] for query in queries.captured_queries if any(table in query['sql'] for table in tables)]
+        self.assertEqual(len(links), 2 * 3)   # ManyToMany fields * chunks of CHUNK (500) catalogs, the export chunk has 1200
+
+
+class DatabaseRouterTest(TransactionTestCase):
+    """reads from the replica, except in transactions and use_primary() (see db.py)"""
+    databases = {'default', 'replica'}
+
+    def test_routing(self):
+        self.assertEqual(router.db_for_read(Product), 'replica')
+        self.assertEqual(router.db_for_write(Product), 'default')
+        with use_primary():
+            self.assertEqual(router.db_for_read(Product), 'default')
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Product), 'default')
+        self.assertEqual(router.db_for_read(Product), 'replica')
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)   # normal
+
+
+class IdRegistryTest(TestCase):
+    """FK/m2m values of imports are checked in the IdRegistry (see registry.py)"""
+    def test_references(self):
+        data = [{'ProductAttributes': {'id': 1, 'attribute': 1, 'product': 7}},   # product of the payload, but not valid
+                {'Product': {'id': 8, 'nazev': 'y', 'description': 'y', 'cena': '1', 'mena': 'EUR'}},
+                {'Product': {'id': 7, 'nazev': 'x', 'description': 'x', 'cena': '1', 'mena': 'USD'}},
+                {'AttributeName': {'id': 1, 'nazev': 'n'}}, {'AttributeValue': {'id': 1, 'hodnota': 'v'}},
+                {'Attribute': {'id': 1, 'nazev_atributu_id': 1, 'hodnota_atributu_id': 1}},
+                {'Image': {'id': 1, 'obrazek': 'https://images.example.com/1.jpg'}},
+                {'Catalog': {'id': 1, 'nazev': 'c', 'obrazek_id': 1, 'products_ids': [7, 8, 9], 'attributes_ids': [1]}}]
+        importer = Importer(FAILURE_STOP)
+        importer.stage(data)
+        with CaptureQueriesContext(connection) as queries:
+            importer.run()
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 2)   # only the pk 9 (not in the payload) and the unique (name, value) of the attribute are checked in the database
+        errors = importer.results['errors']
+        self.assertEqual(len(errors), 3)
+        self.assertIn('product : Invalid pk "7" - object does not exist.', errors[1])
+        self.assertNotIn('obrazek_id :', errors[2])   # the image is valid, not written only because of the 1st error
+        self.assertIn('products_ids : Invalid pk "7" - object does not exist., Invalid pk "9" - object does not exist.)', errors[2])
+        self.assertTrue(Product.objects.filter(pk=8).exists())
+
+
+class PlannerTest(TestCase):
+    """import order derived from FK/m2m fields, repeated id's merged (see planner.py)"""
+    def test_order(self):
+        models = [Model for Model, _Serializer, _import_order in MODELSWITCH.values()]
+        for Model, _Serializer, import_order in MODELSWITCH.values():
+            for Related in dependencies(Model, models):
+                self.assertLess(MODELSWITCH[Related._meta.model_name][2], import_order)
+
+    def test_merge(self):
+        Model, Serializer, import_order = MODELSWITCH['product']
+        first = {'id': 1, 'nazev': 'a'}
+        plan = Plan()
+        for values in (first, {'id': 1, 'nazev': 'b', 'cena': '1'}, {'id': 2}, {'id': 1, 'mena': 'EUR', 'cena': '2'}):
+            plan.add(Model, Serializer, import_order, values['id'], values)
+        self.assertEqual([row[4] for row in plan.rows()], [{'id': 1, 'nazev': 'a', 'cena': '1', 'mena': 'EUR'}, {'id': 2}])
+        self.assertEqual(first, {'id': 1, 'nazev': 'a'})   # items of the payload aren't changed
+
+    def test_plan(self):
+        with open(TEST_DATA, 'rb') as f:
+            data = json.loads(f.read().decode())
+        response = self.client.post('/import?plan=1', json.dumps(data + data[:3]), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        plan = response.json()
+        self.assertEqual((plan['items'], plan['rows'], plan['merged']), (len(data) + 3, 91, len(data) + 3 - 91))
+        self.assertEqual([model['order'] for model in plan['models']], sorted(model['order'] for model in plan['models']))
+        self.assertFalse(Product.objects.exists())
+
+
+class AdminTest(TestCase):
+    """admin pages run the same count of queries for any size of the tables (see admin.py)"""
+    def queries(self):
+        urls = []
+        for model in MODELSWITCH:
+            urls += ['/admin/product_api/%s/' % model, '/admin/product_api/%s/?q=1' % model, '/admin/product_api/%s/1/change/' % model,
+                     '/admin/product_api/%s/autocomplete/?term=' % model]
+        counts = {}
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries, warnings.catch_warnings():
+                warnings.simplefilter('error', UnorderedObjectListWarning)   # pages of autocomplete results need an ordering
+                self.assertEqual(self.client.get(url).status_code, 200)
+            counts[url] = len(queries.captured_queries)
+        return counts
+
+    def test_bounded_queries(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        data = [{'AttributeName': {'id': 1, 'nazev': 'n'}}, {'AttributeValue': {'id': 1, 'hodnota': 'v'}},
+                {'Attribute': {'id': 1, 'nazev_atributu_id': 1, 'hodnota_atributu_id': 1}},
+                {'Product': {'id': 1, 'nazev': 'p', 'description': 'd', 'cena': '1'}},
+                {'ProductAttributes': {'id': 1, 'attribute': 1, 'product': 1}}, {'Image': {'id': 1, 'obrazek': 'https://images.example.com/1.jpg'}},
+                {'ProductImage': {'id': 1, 'product': 1, 'obrazek_id': 1, 'nazev': 'i'}},
+                {'Catalog': {'id': 1, 'nazev': 'c', 'obrazek_id': 1, 'products_ids': [1], 'attributes_ids': [1]}}]
+        self.assertEqual(self.client.post('/import', json.dumps(data), content_type='application/json').status_code, 201)   # 1 row of each table
+        self.queries()   # the first visit of change pages stores the session
+        small = self.queries()
+        self.client.post('/import', json.dumps(generate(1000, catalog_size=200)), content_type='application/json')
+        self.assertEqual(self.queries(), small)
+
+
+class ImportDigestTest(TestCase):
+    """an identical payload gets the results of its last import (see fingerprints.py)"""
+    def test_repeated_payload(self):
+        with open(TEST_DATA, 'rb') as f:
+            payload = f.read()
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000):   # the payload is hashed while parsed, request.body isn't used
+            response = self.client.post('/import', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ImportDigest.objects.count(), 1)
+        with self.assertNumQueries(2):   # ImportDigest + ModelVersion
+            self.assertEqual(self.client.post('/import', payload, content_type='application/json').json(), response.json())
+
+    def test_failed_import(self):
+        payload = json.dumps([{'Product': {'id': 1, 'nazev': 'x', 'description': 'x', 'cena': '1', 'mena': 'USD'}}])
+        self.assertEqual(self.client.post('/import', payload, content_type='application/json').status_code, 400)
+        self.assertFalse(ImportDigest.objects.exists())   # the same payload runs again (the failure can be transient)
+
+
+class ImportJobTest(TestCase):
+    """POST /import?async=1, GET /import/<job>; jobs.recover() of jobs left by a stopped process"""
+    def setUp(self):
+        job_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(job_dir.cleanup)
+        job_settings = override_settings(IMPORT_JOB_WORKERS=0, IMPORT_JOB_DIR=job_dir.name)   # the job runs in the request
+        job_settings.enable()
+        self.addCleanup(job_settings.disable)
+
+    def test_job(self):
+        with open(TEST_DATA, 'rb') as f:
+            response = self.client.post('/import?async=1', f.read(), content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        results = self.client.get(response['Location']).json()
+        self.assertEqual(results, dict(response.json(), status=ImportJob.DONE, total=results['total'], processed=results['total']))
+        self.assertEqual((results['inserted'], results['updated']), (91, 0))
+        self.assertFalse(os.path.exists(ImportJob.objects.get().payload))
+
+        payload = json.dumps(products(2, invalid=[2]))
+        results = self.client.get(self.client.post('/import?async=1', payload, content_type='application/json')['Location']).json()
+        self.assertEqual((results['status'], results['inserted'], len(results['errors'])), (ImportJob.FAILED, 0, 1))
+        self.assertEqual(self.client.get('/import/%s' % (results['job'] + 1)).status_code, 404)
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_media_types(self):
+        ndjson = '\n'.join(json.dumps(item) for item in products(2))
+        response = self.client.post('/import?async=1', ndjson, content_type='application/x-ndjson; charset=utf-8')
+        self.assertEqual(self.client.get(response['Location']).json()['inserted'], 2)
+        response = self.client.post('/import?async=1', msgpack.packb(products(2)), content_type='application/msgpack')
+        self.assertEqual(response.status_code, 415)   # /import accepts it, the stored payload is read as JSON/NDJSON only
+        self.assertEqual(ImportJob.objects.count(), 1)
+
+    def test_recover(self):
+        stopped = []
+        for status in (ImportJob.QUEUED, ImportJob.RUNNING, ImportJob.RUNNING):
+            with mock.patch('product_api.jobs.run'):   # the job stays queued, as in a stopped process
+                job = jobs.create(io.BytesIO(json.dumps(products(3)).encode()))
+            ImportJob.objects.filter(pk=job.pk).update(status=status, processed=1)
+            stopped.append(job)
+        os.remove(stopped[2].payload)
+        self.assertEqual(jobs.recover(), stopped[:2])
+        self.assertEqual([job.status for job in ImportJob.objects.order_by('pk')], [ImportJob.QUEUED, ImportJob.QUEUED, ImportJob.FAILED])
+        for job in stopped[:2]:
+            jobs.run(ImportJob.objects.get(pk=job.pk))
+        self.assertEqual([(job.status, job.inserted, job.updated) for job in ImportJob.objects.order_by('pk')[:2]],
+                         [(ImportJob.DONE, 3, 0), (ImportJob.DONE, 0, 0)])
+        self.assertFalse(os.listdir(settings.IMPORT_JOB_DIR))
+        self.assertEqual(jobs.recover(), [])
+
+
+def products(count, invalid=()):
+    """payload of `count` products, positions (1-based) in `invalid` have an invalid currency"""
+    return [{'Product': {'id': pk, 'nazev': 'p%s' % pk, 'description': 'd', 'cena': '1', 'mena': 'USD' if pk in invalid else 'EUR'}}
+            for pk in range(1, count + 1)]
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedImporter(Importer):
+    """the process is killed while writing the chunk number `chunk`"""
+    def __init__(self, chunk, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chunk = chunk
+
+    def write_group(self, group):
+        self.chunk -= 1
+        if not self.chunk:
+            raise Interrupted
+        super().write_group(group)
+
+
+@override_settings(IMPORT_COMMIT_CHUNK=3)
+class ResumeImportTest(TestCase):
+    """FAILURE_RESUME commits each chunk with its checkpoint, the same payload continues from it"""
+    def run_import(self, data, importer=None):
+        importer = importer or Importer(FAILURE_RESUME, digest='payload')
+        importer.stage(data)
+        importer.run()
+        return importer
+
+    def test_failed_chunk(self):
+        importer = self.run_import(products(11, invalid=[8]))
+        self.assertEqual(importer.results['inserted'], 6)   # only the committed chunks
+        self.assertEqual(importer.checkpoint, 6)
+        self.assertEqual(ImportCheckpoint.get('payload'), 6)
+        self.assertEqual(Product.objects.count(), 6)
+
+        importer = self.run_import(products(11))   # the same digest (ie. the failure was transient)
+        self.assertEqual((importer.results['inserted'], importer.checkpoint), (5, None))
+        self.assertEqual(Product.objects.count(), 11)
+        self.assertEqual(ImportCheckpoint.get('payload'), 0)   # cleared
+
+    def test_interrupted(self):
+        with self.assertRaises(Interrupted):
+            self.run_import(products(11), InterruptedImporter(3, FAILURE_RESUME, digest='payload'))
+        self.assertEqual(ImportCheckpoint.get('payload'), 6)   # 2 chunks committed
+        importer = self.run_import(products(11))
+        self.assertEqual(importer.results, {'inserted': 5, 'updated': 0})
+        self.assertEqual(Product.objects.count(), 11)
+
+    def test_stream(self):
+        importer = StreamImporter(FAILURE_RESUME, batch_size=3)   # 4 batches by id % 4, the last one (3, 7, 11) fails
+        importer.stage(io.BytesIO('\n'.join(json.dumps(item) for item in products(11, invalid=[11])).encode()))
+        importer.run()
+        self.assertEqual((importer.results['inserted'], importer.checkpoint), (8, 8))
+        self.assertEqual(ImportCheckpoint.get(importer.digest), 8)
+
+    def test_stop_counts(self):
+        importer = Importer(FAILURE_STOP)
+        importer.stage(products(5, invalid=[3]))
+        importer.run()
+        self.assertEqual(importer.results['inserted'], 2)   # rows after the 1st error aren't written
+
+
+class DetailCacheTest(TestCase):
+    """cached Detail rows are never served after a change of their row, entries of other rows are kept (see cache.py)"""
+    def setUp(self):
+        get_cache().clear()
+        with open(TEST_DATA, 'rb') as f:
+            self.assertEqual(self.client.post('/import', f.read(), content_type='application/json').status_code, 201)
+
+    def post(self, data):
+        self.assertEqual(self.client.post('/import', json.dumps(data), content_type='application/json').status_code, 201)
+
+    def test_import(self):
+        self.assertNotEqual(self.client.get('/detail/product/1').json()['nazev'], 'Rum')
+        cached = get_cache().get(('product', 1))
+        self.post([{'Product': {'id': 1, 'nazev': 'Rum', 'description': 'x', 'cena': '1'}}])
+        get_cache().set(('product', 1), cached)   # the old entry in another process (invalidated only in this one)
+        self.assertEqual(self.client.get('/detail/product/1').json()['nazev'], 'Rum')
+        self.assertEqual(self.client.get('/detail/product/', {'ids': '1'}).json()['results'][0]['nazev'], 'Rum')
+
+    def test_m2m(self):
+        catalog = self.client.get('/detail/catalog/1').json()
+        cached = get_cache().get(('catalog', 1))
+        products = catalog['products_ids'] = catalog['products_ids'][:1]
+        self.post([{'Catalog': catalog}])
+        get_cache().set(('catalog', 1), cached)
+        self.assertEqual(self.client.get('/detail/catalog/1').json()['products_ids'], products)
+
+    def test_delete(self):
+        self.assertEqual(self.client.get('/detail/image/1').status_code, 200)
+        cached = get_cache().get(('image', 1))
+        Image.objects.filter(pk=1).delete()
+        get_cache().set(('image', 1), cached)
+        self.assertEqual(self.client.get('/detail/image/1').status_code, 404)
+
+    def test_other_rows(self):
+        etag = self.client.get('/detail/product/1')['ETag']
+        self.post([{'Product': {'id': 2, 'nazev': 'Rum', 'description': 'x', 'cena': '1'}}])
+        with self.assertNumQueries(1):   # the stamp of the cached row (LRUCache is local to the process), the row isn't read again
+            self.assertEqual(self.client.get('/detail/product/1', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    @override_settings(DETAIL_CACHE={'BACKEND': 'product_api.cache.DjangoCache', 'OPTIONS': {}})
+    @mock.patch('product_api.cache._cache', None)
+    def test_shared_backend(self):
+        get_cache().clear()
+        response = self.client.get('/detail/product/1')
+        with self.assertNumQueries(0):   # all processes get the invalidations, the entry is served without any query
+            self.assertEqual(self.client.get('/detail/product/1').json(), response.json())
+            self.assertEqual(self.client.get('/detail/product/1', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.post([{'Product': {'id': 1, 'nazev': 'Rum', 'description': 'x', 'cena': '1'}}])
+        self.assertEqual(self.client.get('/detail/product/1').json()['nazev'], 'Rum')
+        self.assertEqual(self.client.get('/detail/product/', {'ids': '1'}).json()['results'][0]['nazev'], 'Rum')
+
+
+def load_test_data():
+    with open(TEST_DATA, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def run_import(data, failure_mode=FAILURE_REVERT):
+    importer = Importer(failure_mode)
+    importer.stage(data)
+    importer.run()
+    return importer.results
+
+
+def export_data():
+    return [item for Model in export.export_models() for item in export.iter_items([Model])]
+
+
+class Rollback(Exception):
+    pass
+
+
+class ImporterTest(TestCase):
+    """bulk writes of Importer (bulk_write) give the same results as the row by row writes (write_rows)"""
+    def changed_data(self):
+        product = [item['Product'] for item in load_test_data() if 'Product' in item][1]
+        return [{'Product': {'id': 1, 'nazev': 'changed', 'description': 'x', 'cena': '1'}},
+                {'Product': product},   # the same values
+                {'Product': {'id': 100, 'nazev': 'new', 'description': 'x', 'cena': '1'}},
+                {'ProductImage': {'id': 1, 'product': 2, 'obrazek_id': 1, 'nazev': 'changed'}}]
+
+    def import_both(self):
+        """results and exported data of the test data + changed_data"""
+        results = [run_import(load_test_data()), run_import(self.changed_data())]
+        return results, export_data()
+
+    def test_counts(self):
+        results, data = self.import_both()
+        self.assertEqual(results, [{'inserted': 91, 'updated': 0}, {'inserted': 1, 'updated': 2}])
+        try:
+            with transaction.atomic():
+                for Model, _Serializer, _import_order in sorted(MODELSWITCH.values(), key=lambda item: -item[2]):
+                    Model.objects.all().delete()
+                with mock.patch('product_api.importer.bulk_write', side_effect=DatabaseError):   # row by row, as before bulk writes
+                    self.assertEqual(self.import_both(), (results, data))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def duplicate_attribute(self):
+        return [{'AttributeName': {'id': 1, 'nazev': 'n'}}, {'AttributeValue': {'id': 1, 'hodnota': 'v'}},
+                {'Attribute': {'id': 1, 'nazev_atributu_id': 1, 'hodnota_atributu_id': 1}},
+                {'Attribute': {'id': 2, 'nazev_atributu_id': 1, 'hodnota_atributu_id': 1}},   # unique (name, value)
+                {'Product': {'id': 1, 'nazev': 'p', 'description': 'd', 'cena': '1'}}]
+
+    def test_unique(self):
+        data = self.duplicate_attribute() + [{'ProductAttributes': {'id': 1, 'attribute': 1, 'product': 1}}]
+        payload = json.dumps(data)
+        dry_run = self.client.post('/import?dry_run=1', payload, content_type='application/json')
+        response = self.client.post('/import', payload, content_type='application/json')
+        self.assertEqual((dry_run.status_code, dry_run.json()), (400, response.json()))
+        self.assertIn("data aren't valid: Attribute {'id': 2,", response.json()['errors'][0])
+        self.assertIn('The fields nazev_atributu_id, hodnota_atributu_id must make a unique set.', response.json()['errors'][0])
+
+        run_import(data[:3] + data[4:])
+        duplicate = json.dumps([{'ProductAttributes': {'id': 1, 'attribute': 1, 'product': 1}},   # the row 1 itself
+                                {'ProductAttributes': {'id': 2, 'attribute': 1, 'product': 1}}])  # the same as the row 1 in the database
+        for url in ('/import?dry_run=1', '/import'):
+            errors = self.client.post(url, duplicate, content_type='application/json').json()['errors']
+            self.assertEqual(len(errors), 1)
+            self.assertIn("ProductAttributes {'id': 2,", errors[0])
+
+    @mock.patch('product_api.importer.unique_clashes', lambda Model, rows: [None] * len(rows))   # written by another import meanwhile
+    def test_stop(self):
+        results = run_import(self.duplicate_attribute(), FAILURE_STOP)
+        self.assertEqual(results['inserted'], 3)   # the bulk insert failed, rows before the wrong one are written one by one
+        self.assertEqual(len(results['errors']), 1)
+        self.assertIn('cannot update database (integrity error,..), Attribute', results['errors'][0])
+        self.assertEqual(list(Attribute.objects.values_list('pk', flat=True)), [1])
+        self.assertFalse(Product.objects.exists())   # not written after the 1st error
+
+    @mock.patch('product_api.importer.unique_clashes', lambda Model, rows: [None] * len(rows))
+    def test_revert(self):
+        results = run_import(self.duplicate_attribute(), FAILURE_REVERT)
+        self.assertEqual((results['inserted'], results['updated'], len(results['errors'])), (0, 0, 1))
+        self.assertFalse(Attribute.objects.exists())
+
+    def test_m2m(self):
+        run_import(load_test_data())
+        Through = Catalog.products_ids.through
+        links = dict(Through.objects.filter(catalog_id=1).values_list('product_id', 'pk'))
+        self.assertEqual(set(links), {1, 2, 3, 4, 5})
+        catalog = {'id': 1, 'nazev': 'c', 'obrazek_id': 1, 'products_ids': [2, 3, 100], 'attributes_ids': [1]}
+        results = run_import([{'Product': {'id': 100, 'nazev': 'p', 'description': 'd', 'cena': '1'}}, {'Catalog': catalog}])
+        self.assertEqual(results, {'inserted': 1, 'updated': 1})
+        new_links = dict(Through.objects.filter(catalog_id=1).values_list('product_id', 'pk'))
+        self.assertEqual(set(new_links), {2, 3, 100})
+        self.assertEqual([new_links[pk] for pk in (2, 3)], [links[pk] for pk in (2, 3)])   # kept, only the differences are written
+        catalog['products_ids'] = [100, 3, 2]
+        self.assertEqual(run_import([{'Catalog': catalog}]), {'inserted': 0, 'updated': 0})
+
+    def test_dry_run(self):
+        data = load_test_data() + [{'Product': {'id': 1, 'cena': 'x'}}]   # merged with the 1st item of product 1 (the earlier wins)
+        invalid = [{'Product': {'id': 200, 'nazev': 'p', 'description': 'd', 'cena': 'x'}},
+                   {'ProductAttributes': {'id': 200, 'attribute': 1, 'product': 200}}]   # references the invalid product
+        for payload in (data, data + invalid):
+            payload = json.dumps(payload)
+            dry_run = self.client.post('/import?dry_run=1', payload, content_type='application/json')
+            self.assertFalse(Product.objects.exists())
+            response = self.client.post('/import', payload, content_type='application/json')
+            self.assertEqual(dry_run.json(), response.json())
+            self.assertEqual((dry_run.status_code, response.status_code), (200, 201) if response.status_code < 400 else (400, 400))
+            Product.objects.all().delete()
+        self.assertEqual(len(dry_run.json()['errors']), 2)
+
+    def assertDryRunCounts(self, data, failure_mode):
+        dry_run = DryRunImporter(failure_mode, workers=1)
+        dry_run.stage(data)
+        dry_run.run()
+        results = run_import(data, failure_mode)
+        self.assertEqual((dry_run.inserted, dry_run.updated), (results['inserted'], results['updated']))
+        return results
+
+    def test_dry_run_check_errors(self):
+        results = self.assertDryRunCounts([{'Foo': {'id': 1}}] + products(2), FAILURE_STOP)
+        self.assertEqual(results['inserted'], 0)   # nothing is written if an item failed the basic checks
+
+    def test_dry_run_stop(self):
+        results = self.assertDryRunCounts(products(4, invalid=[2]), FAILURE_STOP)
+        self.assertEqual(results['inserted'], 1)   # valid rows after the 1st error aren't written
+
+
+class StreamImporterTest(TestCase):
+    """StreamImporter writes a model split into batches batch by batch, not in the payload order (see its docstring)"""
+    def stream_import(self, data, failure_mode, batch_size):
+        importer = StreamImporter(failure_mode, batch_size=batch_size)
+        importer.stage(io.BytesIO(json.dumps(data).encode()))
+        importer.run()
+        written = sorted(Product.objects.values_list('pk', flat=True))
+        Product.objects.all().delete()
+        return importer.results, written
+
+    def test_stop(self):
+        data = products(4, invalid=[3])
+        run_import(data, FAILURE_STOP)
+        expected = sorted(Product.objects.values_list('pk', flat=True))
+        Product.objects.all().delete()
+        self.assertEqual(expected, [1, 2])   # up to the error in the payload
+        self.assertEqual(self.stream_import(data, FAILURE_STOP, 4)[1], expected)   # a single batch, as Importer
+        results, written = self.stream_import(data, FAILURE_STOP, 2)   # batches by id % 2: (2, 4), then (1, 3)
+        self.assertEqual(written, [1, 2, 4])
+        self.assertEqual((results['inserted'], len(results['errors'])), (3, 1))
+        self.assertEqual(self.stream_import(data, FAILURE_REVERT, 2)[1], [])
+
+
+class StreamItemsTest(SimpleTestCase):
+    """iter_items (streaming.py) reads JSON arrays and NDJSON in chunks"""
+    def items(self, data, chunk_size=3):
+        return list(iter_items(io.BytesIO(data.encode()), chunk_size=chunk_size))
+
+    def test_formats(self):
+        items = [{'Product': {'id': 12345, 'nazev': 'žluťoučký'}}, {'Image': {'id': 1234567890}}]
+        array = json.dumps(items, ensure_ascii=False)
+        ndjson = '\n'.join(json.dumps(item, ensure_ascii=False) for item in items) + '\n\n'
+        for chunk_size in (1, 2, 3, 7, 64 * 1024):   # numbers and utf-8 characters split between chunks
+            self.assertEqual(self.items(array, chunk_size), items)
+            self.assertEqual(self.items(ndjson, chunk_size), items)
+        self.assertEqual(self.items('[1, 22,333]'), [1, 22, 333])
+        self.assertEqual(self.items('12\n345'), [12, 345])
+        self.assertEqual(self.items(' [ ] '), [])
+        self.assertEqual(self.items(''), [])
+
+    def test_errors(self):
+        for data in ('[1, 2] 3', '[1, 2', '[1 2]', '[1,, 2]', '{"a": }', '[{"a": 1}'):
+            with self.assertRaises(ValueError, msg=data):
+                self.items(data)
+
+
+class ListTest(TestCase):
+    """List: pages by keyset (?after=&limit=, Link header), ?stream=1, ETag"""
+    def setUp(self):
+        run_import(load_test_data())
+
+    def test_pages(self):
+        ids = self.client.get('/detail/attribute/').json()
+        self.assertEqual(ids, sorted(ids))
+        pages = []
+        url = '/detail/attribute/?limit=10'
+        while url:
+            response = self.client.get(url)
+            pages.append(response.json())
+            link = response.get('Link')
+            url = link[1:link.index('>')] if link else None
+        self.assertEqual([len(page) for page in pages], [10, 10, 7])
+        self.assertEqual(sum(pages, []), ids)
+        self.assertEqual(self.client.get('/detail/attribute/', {'after': ids[-2], 'limit': 10}).json(), ids[-1:])
+        self.assertEqual(self.client.get('/detail/attribute/?after=x').status_code, 400)
+
+        response = self.client.get('/detail/attribute/?stream=1')
+        self.assertEqual(json.loads(b''.join(response.streaming_content).decode()), ids)
+
+    def test_etag(self):
+        for url in ('/detail/product/1', '/detail/product/'):
+            response = self.client.get(url)
+            etag = response['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            run_import([{'Product': {'id': 1, 'nazev': url, 'description': 'x', 'cena': '1'}}])
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+
+class FacetsTest(TestCase):
+    """GET /facets: the index (facets.py) is updated by the imports, rebuild() gives the same index"""
+    def setUp(self):
+        run_import(load_test_data())
+
+    def get(self, *attrs, **params):
+        return self.client.get('/facets', dict(params, attr=attrs)).json()
+
+    def counts(self, result, name):
+        return {value['value']: value['count'] for facet in result['facets'] if facet['name'] == name for value in facet['values']}
+
+    def index(self):
+        return (sorted(FacetLink.objects.values_list('pk', 'attribute_id')),
+                sorted((attribute_id, list(facets.unpack(products))) for attribute_id, products in FacetPosting.objects.values_list('attribute_id', 'products')))
+
+    def test_search(self):
+        result = self.get()
+        self.assertEqual((result['count'], result['products']), (5, [1, 2, 3, 4, 5]))
+        self.assertEqual(self.counts(result, 'Barva'), {'bílá': 2, 'hnědá': 1, 'růžová': 1, 'zelená': 1})
+        result = self.get('Skladem:ano')
+        self.assertEqual(result['products'], [2, 3, 4, 5])
+        self.assertEqual(self.counts(result, 'Skladem'), {'ano': 4})
+        self.assertEqual(self.get('Skladem:ano', 'Barva:bílá', 'Barva:hnědá')['products'], [2, 3, 4])   # names AND, values OR
+        self.assertEqual(self.get('Skladem:ano', after=2, limit=2)['products'], [3, 4])
+        self.assertEqual(self.get('Barva:bílá', catalog=2)['count'], 0)
+        self.assertEqual(self.client.get('/facets', {'attr': 'Barva'}).status_code, 400)
+
+    def test_updates(self):
+        run_import([{'ProductAttributes': {'id': 15, 'attribute': 22, 'product': 5}},   # Skladem: ano -> ne
+                    {'ProductAttributes': {'id': 100, 'attribute': 6, 'product': 1}}])
+        ProductAttributes.objects.filter(pk=4).delete()
+        result = self.get('Skladem:ano')
+        self.assertEqual(result['products'], [2, 3, 4])
+        self.assertEqual(self.counts(self.get(), 'Barva'), {'bílá': 2, 'hnědá': 1, 'růžová': 1, 'zelená': 1})
+        self.assertEqual(self.get('Barva:bílá')['products'], [1, 4])
+        updated = self.index()
+        facets.rebuild()
+        self.assertEqual(self.index(), updated)
+
+    def test_migration(self):
+        """0009_rebuild_facets builds the same index with the historical models"""
+        index = self.index()
+        FacetLink.objects.all().delete()
+        FacetPosting.objects.all().delete()
+        migration = importlib.import_module('product_api.migrations.0009_rebuild_facets')
+        migration.rebuild_facets(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(self.index(), index)
+        self.assertEqual(self.get('Skladem:ano')['products'], [2, 3, 4, 5])
+
+
+class DocumentTest(TestCase):
+    """expanded product documents (?expand=1, see documents.py) are built by a constant count of queries"""
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_document(self):
+        run_import(load_test_data())
+        document = self.get('/detail/product/1?expand=1')
+        self.assertEqual(document, dict(self.get('/detail/product/1'), attributes=document['attributes'], images=document['images'], catalogs=[1]))
+        self.assertEqual([attribute['id'] for attribute in document['attributes']], [1, 2, 3, 7])
+        self.assertEqual(document['attributes'][1], {'id': 2, 'attribute': 4, 'nazev': self.get('/detail/attributename/1'),
+                                                     'hodnota': self.get('/detail/attributevalue/4')})
+        image = document['images'][0]
+        self.assertEqual(image['obrazek'], self.get('/detail/image/%s' % self.get('/detail/productimage/%s' % image['id'])['obrazek_id']))
+        self.assertEqual(self.get('/detail/product/?expand=1'), [self.get('/detail/product/%s?expand=1' % pk) for pk in range(1, 6)])
+        self.assertEqual(self.client.get('/detail/product/100?expand=1').status_code, 404)
+
+    def test_queries(self):
+        counts = []
+        for products in (10, 100):
+            run_import(generate(212 + 6 * products, catalogs=2, catalog_size=5))   # attributes + catalogs, 6 items per product
+            self.assertEqual(Product.objects.count(), products)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(self.get('/detail/product/?expand=1&limit=1000')), products)
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_limit(self):
+        run_import(load_test_data())
+        for limit, count in (('-1', 1), ('0', 1), ('2', 2), ('100000', 5)):
+            self.assertEqual(len(self.get('/detail/product/?expand=1&limit=%s' % limit)), count)
+        self.assertEqual(self.client.get('/detail/product/?expand=1&limit=x').status_code, 400)
+
+
+@mock.patch.dict('product_api.metrics._registry', clear=True)
+class MetricsTest(TestCase):
+    """MetricsMiddleware, phases and GET /metrics (see metrics.py)"""
+    def metrics(self):
+        """({metric with labels: value}, lines) of GET /metrics"""
+        lines = self.client.get('/metrics').content.decode().splitlines()
+        values = dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+        return {metric: float(value) for metric, value in values.items()}, lines
+
+    def test_requests(self):
+        with open(TEST_DATA, 'rb') as f:
+            self.assertEqual(self.client.post('/import', f.read(), content_type='application/json').status_code, 201)
+        for url in ('/detail/product/1', '/detail/product/1', '/detail/foo/1'):
+            self.client.get(url)
+        values, lines = self.metrics()
+
+        self.assertEqual(values['product_api_requests_total{endpoint="detail",model="product",status="200"}'], 2)
+        self.assertEqual(values['product_api_requests_total{endpoint="detail",model="unknown",status="400"}'], 1)   # not from the url
+        self.assertEqual(values['product_api_requests_total{endpoint="import",model="",status="201"}'], 1)
+        self.assertEqual(values['product_api_request_duration_seconds_count{endpoint="detail",model="product"}'], 2)
+
+        phases = {phase: values['product_api_phase_queries_total{endpoint="import",model="",phase="%s"}' % phase]
+                  for phase in ('parse', 'lookup', 'validate', 'write')}
+        self.assertEqual(phases['parse'], 0)
+        self.assertGreater(phases['write'], 0)
+        self.assertLessEqual(sum(phases.values()), values['product_api_db_queries_total{endpoint="import",model=""}'])
+
+        self.assertIn('# TYPE product_api_request_queries histogram', lines)
+        buckets = [line for line in lines if line.startswith('product_api_request_queries_bucket{endpoint="detail",le=') and 'model="product"' in line]
+        self.assertEqual([line.split('le="')[1].split('"')[0] for line in buckets], [str(bucket) for bucket in metrics.QUERY_BUCKETS] + ['+Inf'])
+        counts = [values[line.rsplit(' ', 1)[0]] for line in buckets]
+        self.assertEqual(counts, sorted(counts))   # cumulative
+        self.assertEqual(counts[-1], values['product_api_request_queries_count{endpoint="detail",model="product"}'])
+
+    def test_allowed_ips(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+    def test_import_log(self):
+        importer = Importer()
+        with metrics.collect() as collector, mock.patch('product_api.importer.logger') as logger:
+            importer.stage(products(3))
+            importer.run()
+            importer.log()
+        message = logger.info.call_args[0][0]
+        self.assertTrue(message.startswith('import - inserted 3, updated 0 - %s queries, db ' % collector.queries), message)
+        self.assertRegex(message, r'\(.*validate [0-9.]+ s/0 q, write [0-9.]+ s/\d+ q\)$')
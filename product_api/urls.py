@@ -19,13 +19,21 @@ from django.urls import path, include
 
 from rest_framework.urlpatterns import format_suffix_patterns
 
-from product_api.views import Detail, List, Import
+from product_api.metrics import metrics_view
+from product_api.views import Changes, Detail, Export, Facets, List, Import, ImportStatus, StreamImport
 
 
 urlpatterns = [
     url(r'^import$', Import.as_view(), name='view_import'),
+    path('import/stream', StreamImport.as_view(), name='view_import_stream'),
+    path('import/<int:job>', ImportStatus.as_view(), name='view_import_status'),
     path('detail/<str:model>/<int:pk>', Detail.as_view(), name='view_detail'),
     path('detail/<str:model>/', List.as_view(), name='view_list'),
+    path('facets', Facets.as_view(), name='view_facets'),
+    path('changes', Changes.as_view(), name='view_changes'),
+    path('export', Export.as_view(), name='view_export'),
 ]
 
-urlpatterns = format_suffix_patterns(urlpatterns)
+urlpatterns = format_suffix_patterns(urlpatterns) + [
+    path('metrics', metrics_view, name='metrics'),
+]
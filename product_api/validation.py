@@ -0,0 +1,126 @@
+"""dry run of imports (POST /import?dry_run=1): items are checked and validated by serializers, nothing is written
+
+Validation reads the database only (existing rows, FK targets), in autocommit mode, so it doesn't lock the tables.
+FK/M2M values which reference rows of the same payload (not in the database yet) are accepted (see registry.py),
+because the real import writes the referenced models first (import order), unless the referenced rows aren't valid:
+models are validated one by one in the import order, like in the real import.
+Large payloads are validated by a pool of forked processes (validation is CPU bound, items of a model are independent).
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+from .importer import FAILURE_REVERT, Importer, ModelSwitch, invalid_message, unique_clashes
+from .planner import Plan
+from .registry import IdRegistry
+
+CHUNK_SIZE = 1000          # items validated by a worker at once
+PARALLEL_MIN_ITEMS = 5000  # smaller payloads are validated in this process
+
+_registry = None   # IdRegistry of the staged rows, set in the worker processes (see init_worker)
+
+
+class DryRunImporter(Importer):
+    """validate the items like Importer, but never write
+
+        importer = DryRunImporter()
+        importer.stage(data)
+        importer.run()          # validate only
+        importer.results        # inserted/updated: rows which would be inserted/changed (if valid)
+    """
+    def __init__(self, failure_mode=None, workers=None):
+        super().__init__(failure_mode)
+        self.workers = settings.IMPORT_VALIDATION_WORKERS if workers is None else workers
+        self.plan = Plan()   # staged items, repeated id's merged
+
+    def prepare(self, staged):
+        """merge repeated id's (the earlier item wins, as in Importer.prepare), no database queries"""
+        for checked in staged:
+            self.plan.add(*checked)
+
+    def run(self):
+        """validate all items (even if some of them failed the basic checks), in the import order
+        the counts are those of Importer.run: nothing after the basic checks failed, nothing after the 1st error
+        """
+        checked = not self.errors   # Importer.run writes nothing if the basic checks failed
+        rows = self.plan.rows()
+        staged = {}
+        for Model, _Serializer, _import_order, pk, _values in rows:
+            staged.setdefault(Model._meta.model_name, set()).add(pk)
+        models = []   # [(model name, tasks)] in the import order, tasks: [items of a chunk]
+        for Model, _Serializer, _import_order, pk, values in rows:
+            model = Model._meta.model_name
+            if not models or models[-1][0] != model:
+                models.append((model, []))
+            tasks = models[-1][1]
+            if not tasks or len(tasks[-1]) >= CHUNK_SIZE:
+                tasks.append([])
+            tasks[-1].append((pk, values))
+
+        discarded = {}   # {model name: pk's of new rows which aren't valid}, as Importer.write_group discards them
+        parallel = self.workers > 1 and len(rows) >= PARALLEL_MIN_ITEMS
+        with metrics.phase('validate'):   # queries of forked workers aren't counted
+            if parallel and not any(conn.in_atomic_block for conn in connections.all()):   # connections can't be closed in a transaction
+                connections.close_all()   # forked workers must open their own connections
+                with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'),
+                                         initializer=init_worker, initargs=(staged,)) as pool:
+                    for model, tasks in models:   # model by model: rows referencing invalid rows of earlier models aren't valid
+                        self.add_results(model, pool.map(validate_chunk, [model] * len(tasks), tasks, [discarded] * len(tasks)), discarded)
+            else:
+                init_worker(staged)
+                for model, tasks in models:
+                    self.add_results(model, [validate_chunk(model, items, discarded) for items in tasks], discarded)
+        if not checked or self.failure_mode == FAILURE_REVERT and self.failed:
+            self.inserted = self.updated = 0   # the same results as the real import would have
+
+    def add_results(self, model, results, discarded):
+        for result in results:
+            for pk, new, changed, error in result:
+                if error:
+                    self.failed = True
+                    self.add_error(error)
+                    if new:
+                        discarded.setdefault(model, set()).add(pk)
+                elif not self.failed:   # valid rows after the 1st error aren't written (Importer.write_group)
+                    self.inserted += new
+                    self.updated += changed
+
+
+def init_worker(staged):
+    """registry of the staged rows (rows of other models found in the database are added by load_references)"""
+    global _registry
+    _registry = IdRegistry()
+    for model, pks in staged.items():
+        _registry.stage(ModelSwitch.classes(model)[0], pks)
+
+
+def validate_chunk(model, items, discarded):
+    """validate items [(pk, values)] of a single model (+ its unique constraints, see unique_clashes),
+    discarded: {model name: pk's of new rows of earlier models which aren't valid}
+    returns [(pk, new row, changed, error message or None)] for the items
+    """
+    for name, pks in discarded.items():
+        _registry.discard(ModelSwitch.classes(name)[0], pks)
+    Model, Serializer, _import_order = ModelSwitch.classes(model)
+    existing = Model.objects.in_bulk([pk for pk, _values in items])
+    Model.prefetch_m2m_pks(list(existing.values()))
+    context = {'registry': _registry}
+    serializers = [Serializer(data=values, context=context) if existing.get(pk) is None else Serializer(existing[pk], data=values, context=context)
+                   for pk, values in items]
+    _registry.load_references(serializers)
+    checked = [serializer.is_valid() for serializer in serializers]
+    clashes = iter(unique_clashes(Model, [(pk, serializer.validated_data)
+                                          for (pk, _values), serializer, ok in zip(items, serializers, checked) if ok]))
+    results = []
+    for (pk, _values), serializer, ok in zip(items, serializers, checked):
+        row = existing.get(pk)
+        errors = next(clashes) if ok else serializer.errors
+        if not errors:
+            changed = row is not None and any(row.changes(**serializer.validated_data))
+            results.append((pk, row is None, changed, None))
+        else:
+            results.append((pk, row is None, False, invalid_message(serializer, errors)))
+    return results
@@ -1,188 +1,432 @@
-from datetime import datetime
-from operator import itemgetter
+import hashlib
+from collections import OrderedDict
 
-from logzero import logger
-
-from django.db import transaction
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 from rest_framework import status
+from rest_framework.exceptions import UnsupportedMediaType
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 
-from . import models, serializers
-
-FAILURE_STOP = False   # with first error stop update the database but preserve previous changes
-FAILURE_REVERT = True  # with first error revert all changes
-
-FAILURE_MODE = FAILURE_REVERT  # FAILURE_STOP or FAILURE_REVERT
+from . import changes, export, facets, fingerprints, jobs, metrics, models
+from .cache import get_rows, set_rows
+from .db import use_primary
+from .documents import DOCUMENT_MODELS, product_documents
+from .importer import FAILURE_REVERT, Importer, ModelSwitch
+from .models import Change, ImportJob, ModelVersion
+from .readers import get_reader
+from .renderers import PARSER_CLASSES, RENDERER_CLASSES
+from .streaming import HashingReader, StreamImporter
+from .validation import DryRunImporter
 
+LIST_CHUNK_SIZE = 2000   # rows fetched from the database at once, if List is streamed
+BATCH_MAX_IDS = 1000     # rows which can be requested from List at once (?ids=..)
+EXPAND_LIMIT = 100       # default page size of expanded product documents (List ?expand=1)
+EXPAND_MAX_LIMIT = 1000
+FACETS_LIMIT = 100       # default count of product id's returned by Facets
+CHANGES_LIMIT = 1000     # default page size of Changes
+CHANGES_MAX_LIMIT = 10000
+STREAM_MEDIA_TYPES = ['application/json', 'application/x-ndjson']   # read by streaming.iter_items (background imports)
 
-MODELSWITCH = {
-    'attributename': (models.AttributeName, serializers.AttributeNameSerializer, 0),
-    'attributevalue': (models.AttributeValue, serializers.AttributeValueSerializer, 1),
-    'attribute': (models.Attribute, serializers.AttributeSerializer, 2),
-    'product': (models.Product, serializers.ProductSerializer, 3),
-    'productattributes': (models.ProductAttributes, serializers.ProductAttributesSerializer, 4),
-    'image': (models.Image, serializers.ImageSerializer, 5),
-    'productimage': (models.ProductImage, serializers.ProductImageSerializer, 6),
-    'catalog': (models.Catalog, serializers.CatalogSerializer, 7),  # last one is import order (imports need sorting before they can be applied, with regard to FK)
-}
 
 # curl -i -X POST localhost:8000/import -H "Content-Type: application/json" --data-binary "@zadani/django-assignment/test_data.json"
+# curl -i -X POST "localhost:8000/import?async=1" -H "Content-Type: application/json" --data-binary "@zadani/django-assignment/test_data.json"
+# curl -i -X POST "localhost:8000/import?dry_run=1" -H "Content-Type: application/json" --data-binary "@zadani/django-assignment/test_data.json"
+# curl -i -X POST "localhost:8000/import?plan=1" -H "Content-Type: application/json" --data-binary "@zadani/django-assignment/test_data.json"
+@method_decorator(use_primary(), name='dispatch')   # imports read the rows they write, from the primary database (see db.py)
 class Import(APIView):
-    """POST (or PUT) /import : import or update rows in the database from a list of mappings: {tablename: {"id":NNN, <other_values>}}"""
+    """POST (or PUT) /import : import or update rows in the database from a list of mappings: {tablename: {"id":NNN, <other_values>}}
+    ?async=1 : store the data (JSON or NDJSON only) and import them in the background, see ImportStatus
+    ?dry_run=1 : validate only, nothing is written (the same results, 200 instead of 201)
+    ?plan=1 : only the import plan (models in the import order, counts of items and merged rows, see planner.py), no validation
+    unchanged items (and an identical payload, if the data haven't changed since) are skipped, see fingerprints.py
+    """
+    renderer_classes = RENDERER_CLASSES   # JSON (orjson) or MessagePack, see renderers.py
+    parser_classes = PARSER_CLASSES
+
     def put(self, request):
-        errors = []
+        if request.query_params.get('async'):
+            return self.put_async(request)
+
+        plan = request.query_params.get('plan')
+        dry_run = request.query_params.get('dry_run') or plan
+        importer = DryRunImporter() if dry_run else Importer()
+        digest = None
+        stream = request.stream   # parsed from the stream: request.body would limit the size (DATA_UPLOAD_MAX_MEMORY_SIZE)
+        if not dry_run and stream is not None:
+            stream = HashingReader(stream, fingerprints.payload_hash(importer.failure_mode))
+
+        with metrics.phase('parse'):
+            data = parse_stream(request, stream)
+        if type(data) not in (list, tuple):
+            return Response({'errors': ["list (of insert's and/or update's) is required"]}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not dry_run:
+            digest = importer.digest = stream.hash.hexdigest()
+            results = fingerprints.previous_results(digest)
+            if results is not None:   # the same payload has been imported and the data haven't changed since
+                return import_response(results, importer.failure_mode)
+
+        importer.stage(data)
+        if plan:
+            results = importer.plan.describe()
+            if importer.errors:
+                results['errors'] = importer.errors
+            return Response(results)
+        importer.run()
+        if digest:
+            importer.log()
+            if importer.checkpoint is None and not importer.errors:   # a failed import (ie. database locked) must run again
+                fingerprints.save_results(digest, importer.results)
+        return import_response(importer.results, importer.failure_mode, dry_run=dry_run)
+
+    def put_async(self, request):
+        if request.stream is None:
+            return Response({'errors': ["list (of insert's and/or update's) is required"]}, status=status.HTTP_400_BAD_REQUEST)
+        if request.content_type.split(';')[0].strip().lower() not in STREAM_MEDIA_TYPES:   # the stored body is parsed by iter_items
+            raise UnsupportedMediaType(request.content_type)
+        job = jobs.create(request.stream)
+        return Response(jobs.status(job), status=status.HTTP_202_ACCEPTED, headers={'Location': reverse('view_import_status', args=[job.pk])})
 
-        def bad_request(msg):
-            return Response({'errors': [msg]}, status=status.HTTP_400_BAD_REQUEST)
+    post = put    # POST: because required in task assignment ; PUT: because of idempotent behaviour
 
-        def add_error(msg):
-            errors.append(msg)
 
-        def model():  # for error reporting only
-            return str(serializer.__class__)[32:-12]  # <class 'product_api.serializers.ProductSerializer'>  ->   Product
+# curl -i -X GET localhost:8000/import/1
+@method_decorator(use_primary(), name='dispatch')
+class ImportStatus(APIView):
+    """GET /import/<job> : status, progress and results of a background import (POST /import?async=1)"""
+    def get(self, request, job, format=None):
+        return Response(jobs.status(get_object_or_404(ImportJob, pk=job)))
 
-        def log_import():
-            msg = 'import - inserted %s, updated %s'
-            if errors:
-                logger.error(msg % (inserted, updated) + ' - errors (!)')
-                for err in errors:
-                    logger.warning(err)
-            else:
-                logger.info(msg % (inserted, updated))
 
-        data = request.data
-        if type(data) not in (list, tuple):
-            return bad_request("list (of insert's and/or update's) is required")
-
-        updates = []   # list of prepared changes
-        index = {}     # index of id's in prepared changes
-        inserted = updated = 0
-
-        for i, item in enumerate(data):
-            kv = item.items()
-            if len(kv) != 1:
-                add_error("each item must contain 1 key (model name) and 1 value (inserted or updated values), which fails for: item %s" % i)
-                continue
-
-            for key, values in kv:
-                break
-
-            Model, Serializer, import_order = ModelSwitch.classes(key)
-            if Model is None:
-                add_error("each item must contain 1 key which must be a known model name, which fails for: item %s, %s" % (i, key))
-                continue
-
-            pk = values.get('id')
-            if pk is None:
-                add_error("each item must contain the value 'id', which fails for: item %s, %s" % (i, key))
-                continue
-
-            updates_key = (Model, pk)
-            pos = index.get(updates_key)
-            if pos is None:
-                try:
-                    row = Model.objects.get(pk=pk)
-                except Model.DoesNotExist:
-                    row = None
-                if row is None:   # id not prepared for update and not in db
-                    serializer = Serializer(data=values)
-                    inserted += 1
-                else:             # id not prepared for update but exists in db
-                    serializer = Serializer(row, data=values)   # we will use this for validation, but ...
-                    # ... no idea how to force Update instead of Insert, so lets update using the model-instance
-                    #   which (as everything) is not easy in Django, but see models.py:UpdateMixin
-                index[updates_key] = len(updates)
-                updates.append([serializer, import_order, row])  # row we need for the Update (using Model instead of Serializer) mentioned above
-            else:                 # id already prepared from an earlier item in this import
-                values.update(updates[pos][0].initial_data)
-                updates[pos][0] = Serializer(data=values)
-
-        updates.sort(key=itemgetter(1))  # if we sort models into order based on FK dependencies, we can save the import in some cases (stable sort is good here!)
-        index = None   # not used anymore, but to be sure; because after the Sort is Index invalidated
-
-        if not errors:
-            failed = False
-            try:
-                with transaction.atomic():     # This code executes inside a transaction
-                    for serializer, _import_order, row in updates:
-                        if serializer.is_valid():
-                            if not failed:     # we will never update the db more after the 1st error
-                                required_id = serializer.initial_data.get('id')
-                                try:
-                                    if row:   # Update instead of Insert (because I have no idea how to implement such a stupid thing with serializer itself)
-                                        if row.update(**serializer.validated_data):   # see models.py:UpdateMixin
-                                            updated += 1
-                                        instance = row
-                                    else:
-                                        instance = serializer.save()
-                                except Exception as exc:
-                                    # raise exc  # for Debug purposes
-                                    failed = True
-                                    add_error("cannot update database (integrity error,..), %s %s" % (model(), serializer.initial_data))
-                                if not failed and required_id and instance.id != required_id:   # not saved as expected ('if not failed' is necessary, otherwise 'instance' is missing)
-                                    failed = True
-                                    if FAILURE_MODE == FAILURE_STOP:  # we want preserve all previous, but this instance is corrupted
-                                        instance.delete()
-                                    add_error("id order mismatch, different id expected, %s %s but id %s received" % (model(), serializer.initial_data, instance.id))
-                        else:
-                            failed = True
-                            err = []
-                            for k in serializer.errors:
-                                err.append('%s : %s' % (k, ', '.join(serializer.errors[k])))
-                            add_error("data aren't valid: %s %s (%s)" % (model(), serializer.initial_data, '; '.join(err)))
-                    if FAILURE_MODE == FAILURE_REVERT and failed:
-                        raise RuntimeError  # break+revert transaction
-            except RuntimeError as exc:     # this is just to continue after transaction is reverted
-                inserted = updated = 0
-            except transaction.TransactionManagementError as exc:
-                inserted = updated = 0
-                add_error("+ transaction.TransactionManagementError (more SQL commands after Rollback)")
-
-        results = {'inserted': inserted, 'updated': updated}
-        if errors:
-            results.update({'errors': errors})
-        log_import()
-        return Response(results, status=status.HTTP_400_BAD_REQUEST if errors and FAILURE_MODE == FAILURE_REVERT else status.HTTP_201_CREATED)
+# curl -i -X POST localhost:8000/import/stream -H "Content-Type: application/x-ndjson" --data-binary "@feed.ndjson"
+@method_decorator(use_primary(), name='dispatch')
+class StreamImport(APIView):
+    """POST (or PUT) /import/stream : the same as /import, but the body (JSON list or NDJSON) is parsed item by item, for huge imports"""
+    def put(self, request):
+        if request.stream is None:
+            return Response({'errors': ["list (of insert's and/or update's) is required"]}, status=status.HTTP_400_BAD_REQUEST)
 
-    post = put    # POST: because required in task assignment ; PUT: because of idempotent behaviour
+        importer = StreamImporter()
+        try:
+            with metrics.phase('parse'):   # items are checked and prepared while parsed
+                importer.stage(request.stream)
+        except ValueError as exc:
+            return Response({'errors': ['cannot parse the data: %s' % exc]}, status=status.HTTP_400_BAD_REQUEST)
+        importer.run()
+        importer.log()
+        return import_response(importer.results, importer.failure_mode)
+
+    post = put
+
+
+def parse_stream(request, stream):
+    """data of the request parsed from the stream (request.stream or its wrapper) by the parser selected for the request"""
+    if stream is None:   # empty body
+        return None
+    parser = request.negotiator.select_parser(request, request.parsers)
+    if parser is None:
+        raise UnsupportedMediaType(request.content_type)
+    return parser.parse(stream, request.content_type, request.parser_context)
+
+
+def import_response(results, failure_mode, dry_run=False):
+    if results.get('errors') and failure_mode == FAILURE_REVERT:
+        return Response(results, status=status.HTTP_400_BAD_REQUEST)
+    return Response(results, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
+
+# curl -X GET localhost:8000/export > export.json ; curl -i -X POST localhost:8000/import/stream --data-binary "@export.json"
+# curl -i -X GET "localhost:8000/export?model=product&model=catalog&ndjson=1"
+class Export(APIView):
+    """GET /export : all rows of all tables in the format of /import (JSON list), streamed, in the import order
+    ?model=<tablename> (repeated) : these tables only
+    ?ndjson=1 : NDJSON, 1 item per line (/import/stream accepts both)
+    header X-Changes-Since: seq of the change feed before the export, /changes?since=<seq> gives rows changed during and after it
+    """
+    def get(self, request, format=None):
+        models = None
+        if 'model' in request.query_params:
+            models = [model.lower() for model in request.query_params.getlist('model')]
+            unknown = [model for model in models if ModelSwitch.classes(model)[0] is None]
+            if unknown:
+                return Response({'errors': ['unknown model: %s' % ', '.join(unknown)]}, status=status.HTTP_400_BAD_REQUEST)
+        ndjson = bool(request.query_params.get('ndjson'))
+        response = StreamingHttpResponse(export.export_json(export.export_models(models), ndjson=ndjson),
+                                         content_type='application/x-ndjson' if ndjson else 'application/json')
+        response['X-Changes-Since'] = export.last_seq()
+        return response
+
+
+# curl -i -X GET "localhost:8000/changes?since=0&limit=100&payload=1"
+class Changes(APIView):
+    """GET /changes?since=<seq> : rows changed (inserted, updated, deleted, ManyToMany links) after the seq, see changes.py
+    returns [{'seq': N, 'model': <tablename>, 'id': N}] in the order of seq, each row once (its last change)
+    ?limit=N : page size, header Link: <..>; rel="next" is set if there can be a next page (the same as List)
+    ?model=<tablename> (repeated) : changes of these models only
+    ?payload=1 : with 'data' of each row (the same as Detail) or 'deleted': true
+    """
+    renderer_classes = RENDERER_CLASSES   # JSON (orjson) or MessagePack, see renderers.py
+
+    def get(self, request, format=None):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = max(1, min(int(request.query_params.get('limit', CHANGES_LIMIT)), CHANGES_MAX_LIMIT))
+        except ValueError:
+            return Response({'errors': ["'since' and 'limit' must be integers"]}, status=status.HTTP_400_BAD_REQUEST)
+        models = None
+        if 'model' in request.query_params:
+            models = [model.lower() for model in request.query_params.getlist('model')]
+            unknown = [model for model in models if ModelSwitch.classes(model)[0] is None]
+            if unknown:
+                return Response({'errors': ['unknown model: %s' % ', '.join(unknown)]}, status=status.HTTP_400_BAD_REQUEST)
+
+        with metrics.phase('serialize'):
+            feed = changes.changes(since=since, limit=limit, models=models, payload=bool(request.query_params.get('payload')))
+        if len(feed) == limit:
+            params = request.query_params.copy()
+            params['since'] = feed[-1]['seq']
+            next_page = '%s?%s' % (request.build_absolute_uri(request.path), params.urlencode())
+            return Response(feed, headers={'Link': '<%s>; rel="next"' % next_page})
+        return Response(feed)
+
+
+# curl -i -X GET "localhost:8000/facets?catalog=1&attr=Barva:modrá&attr=Barva:zelená&attr=Skladem:ano"
+class Facets(APIView):
+    """GET /facets : products filtered by attributes and counts of products for each attribute value (see facets.py)
+    ?attr=<name>:<value> (repeated) : products must have all given names, each with any of its given values
+    ?catalog=<id> : products of the catalog only
+    ?after=<id>&limit=N : page of the returned product id's (count is always of all of them)
+    returns {'count': N, 'products': [id's], 'facets': [{'name': .., 'values': [{'value': .., 'count': N}]}]}
+    """
+    def get(self, request, format=None):
+        filters = []
+        for attr in request.query_params.getlist('attr'):
+            name, separator, value = attr.partition(':')
+            if not separator:
+                return Response({'errors': ["attr must be <name>:<value>, which fails for: %s" % attr]}, status=status.HTTP_400_BAD_REQUEST)
+            filters.append((name, value))
+        try:
+            catalog = request.query_params.get('catalog')
+            catalog = None if catalog is None else int(catalog)
+            after = int(request.query_params.get('after', 0))
+            limit = int(request.query_params.get('limit', FACETS_LIMIT))
+        except ValueError:
+            return Response({'errors': ["'catalog', 'after' and 'limit' must be integers"]}, status=status.HTTP_400_BAD_REQUEST)
+
+        products, counts = facets.search(filters, catalog=catalog)
+        page = sorted(pk for pk in products if pk > after)[:limit]
+        names = OrderedDict()
+        for (name, value), count in sorted(counts.items()):
+            names.setdefault(name, []).append({'value': value, 'count': count})
+        return Response({
+            'count': len(products),
+            'products': page,
+            'facets': [{'name': name, 'values': values} for name, values in names.items()],
+        })
+
+
+def model_version(request, model):
+    """(version, modified) of the model (see ModelVersion), (None, None) for unknown model; 1 query per request"""
+    if not hasattr(request, 'model_version'):
+        Model = ModelSwitch.classes(model)[0]
+        if Model is None:
+            request.model_version = (None, None)
+        elif expand(request, Model):
+            request.model_version = ModelVersion.get_combined(DOCUMENT_MODELS)
+        else:
+            request.model_version = ModelVersion.get(Model._meta.model_name)
+    return request.model_version
+
+
+def expand(request, Model):
+    """expanded product documents are requested (see documents.py)"""
+    return Model is models.Product and request.query_params.get('expand')
+
+
+def detail_version(request, model, pk):
+    """(version, modified) of a Detail response: the stamp of the row (Change.stamps), taken from its cache entry if it is
+    cached (see cache.py), or of all document models for ?expand=1 (see model_version); (None, None) for unknown model
+    """
+    if not hasattr(request, 'detail_version'):
+        Model = ModelSwitch.classes(model)[0]
+        request.detail_entry = None
+        if Model is None or expand(request, Model):
+            request.detail_version = model_version(request, model)
+        else:
+            name = Model._meta.model_name
+            request.detail_entry = get_rows(name, [pk]).get(pk)
+            request.detail_version = request.detail_entry[0] if request.detail_entry else Change.stamps(name, [pk])[pk]
+    return request.detail_version
+
+
+def detail_etag(request, model, pk):
+    version = detail_version(request, model, pk)[0]
+    if version is None:
+        return None
+    document = '-expand' if expand(request, ModelSwitch.classes(model)[0]) else ''
+    return '"%s-%s%s-%s-%s"' % (model.lower(), pk, document, version, request.accepted_renderer.format)
+
+
+def detail_last_modified(request, model, pk):
+    return detail_version(request, model, pk)[1]
+
+
+def list_etag(request, model):
+    version = model_version(request, model)[0]
+    if version is None:
+        return None
+    params = hashlib.md5(request.META.get('QUERY_STRING', '').encode()).hexdigest()[:12]   # pages have different ETags
+    return '"%s-list-%s-%s-%s"' % (model.lower(), version, request.accepted_renderer.format, params)
+
+
+def last_modified(request, model, **kwargs):
+    return model_version(request, model)[1]
 
 
 # curl -i -X GET localhost:8000/detail/product/ -H "Content-Type: application/json"
+# curl -i -X GET "localhost:8000/detail/product/?after=100&limit=50" -H "Content-Type: application/json"
 class List(APIView):
-    """GET /detail/<tablename>/ : list all rows from the table <tablename>"""
+    """GET /detail/<tablename>/ : list all rows (id's) from the table <tablename>
+    ?after=<id>&limit=N : page of id's (greater than <id>), header Link: <..>; rel="next" is set if there is a next page
+    ?stream=1 : all id's, streamed as chunked JSON list (constant memory for huge tables)
+    ?ids=1,2,3 : all fields of these rows (as in Detail), see .post()
+    ?expand=1 : (product only) expanded product documents (see documents.py), page by ?after=<id>&limit=N (1..EXPAND_MAX_LIMIT, default EXPAND_LIMIT)
+    ETag/Last-Modified: If-None-Match and If-Modified-Since are answered by 304 (see ModelVersion)
+    """
+    renderer_classes = RENDERER_CLASSES   # JSON (orjson) or MessagePack, see renderers.py
+    parser_classes = PARSER_CLASSES
+
+    @method_decorator(condition(etag_func=list_etag, last_modified_func=last_modified))
     def get(self, request, model, format=None):
-        Model, Serializer, _import_order = ModelSwitch.classes(model)
+        Model = ModelSwitch.classes(model)[0]
         if Model is None:
             return Response(status=status.HTTP_400_BAD_REQUEST)
-        rows = Model.objects.all()
-        serializer = Serializer(rows, many=True, as_list=True)
-        return Response([row['id'] for row in serializer.data])  # returns id's as list; use this if all serializers return id only
-        # return Response(serializer.data)                       # returns list of dict (fields); use this if serializers should return different fields (have different list_fields)
+        if 'ids' in request.query_params:
+            return self.batch(request, Model, request.query_params['ids'].split(','))
+        if expand(request, Model):
+            return self.expanded(request)
+
+        ids = Model.objects.order_by('pk').values_list('pk', flat=True)   # id's only, no model instances and serializers
+
+        if request.query_params.get('stream'):
+            return StreamingHttpResponse(json_list(ids.iterator(chunk_size=LIST_CHUNK_SIZE)), content_type='application/json')
+
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = int(request.query_params.get('limit', 0))
+        except ValueError:
+            return Response({'errors': ["'after' and 'limit' must be integers"]}, status=status.HTTP_400_BAD_REQUEST)
+        if after:
+            ids = ids.filter(pk__gt=after)
+        if limit > 0:
+            ids = list(ids[:limit])
+            if len(ids) == limit:
+                next_page = '%s?after=%s&limit=%s' % (request.build_absolute_uri(request.path), ids[-1], limit)
+                return Response(ids, headers={'Link': '<%s>; rel="next"' % next_page})
+        return Response(list(ids))
+
+    # curl -i -X POST localhost:8000/detail/product/ -H "Content-Type: application/json" --data '{"ids": [1, 2, 3]}'
+    def post(self, request, model, format=None):
+        """POST /detail/<tablename>/ {"ids": [1, 2, 3]} : all fields of these rows, like GET ?ids=1,2,3 (for long lists of id's)"""
+        Model = ModelSwitch.classes(model)[0]
+        if Model is None:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if type(ids) is not list:
+            return Response({'errors': ["{'ids': [list of id's]} is required"]}, status=status.HTTP_400_BAD_REQUEST)
+        return self.batch(request, Model, ids)
+
+    def expanded(self, request):
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = max(1, min(int(request.query_params.get('limit', EXPAND_LIMIT)), EXPAND_MAX_LIMIT))
+        except ValueError:
+            return Response({'errors': ["'after' and 'limit' must be integers"]}, status=status.HTTP_400_BAD_REQUEST)
+        with metrics.phase('serialize'):
+            documents = product_documents(after=after, limit=limit)
+        if len(documents) == limit:
+            next_page = '%s?expand=1&after=%s&limit=%s' % (request.build_absolute_uri(request.path), documents[-1]['id'], limit)
+            return Response(documents, headers={'Link': '<%s>; rel="next"' % next_page})
+        return Response(documents)
+
+    def batch(self, request, Model, ids):
+        """{'results': [rows in the order of ids], 'missing': [ids which don't exist]}, rows are taken from the cache or 1 query"""
+        try:
+            ids = list(OrderedDict.fromkeys(int(pk) for pk in ids))   # without duplicates, in the original order
+        except (TypeError, ValueError):
+            return Response({'errors': ["id's must be integers"]}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > BATCH_MAX_IDS:
+            return Response({'errors': ["max. %s id's can be requested at once" % BATCH_MAX_IDS]}, status=status.HTTP_400_BAD_REQUEST)
+
+        name = Model._meta.model_name
+        found = {pk: data for pk, (_stamp, data) in get_rows(name, ids).items()}
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            stamps = Change.stamps(name, missing)   # before the rows, see set_rows
+            with metrics.phase('serialize'):
+                rows = get_reader(Model).rows(missing)
+            set_rows(name, stamps, rows)
+            found.update(rows)
+        return Response({
+            'results': [found[pk] for pk in ids if pk in found],
+            'missing': [pk for pk in ids if pk not in found],
+        })
 
 
 # curl -i -X GET localhost:8000/detail/product/1 -H "Content-Type: application/json"
+# curl -i -X GET localhost:8000/detail/product/1 -H "Accept: application/msgpack"
 class Detail(APIView):
-    """GET /detail/<tablename>/<pk> : list all fields from the table <tablename> at the row with id <pk>"""
+    """GET /detail/<tablename>/<pk> : list all fields from the table <tablename> at the row with id <pk>
+    served from the cache (see cache.py) if possible
+    ?expand=1 : (product only) expanded product document, see documents.py
+    ETag/Last-Modified: If-None-Match and If-Modified-Since are answered by 304 (the row's last change, see Change.stamps;
+        ModelVersion for ?expand=1)
+    """
+    renderer_classes = RENDERER_CLASSES   # JSON (orjson) or MessagePack, see renderers.py
+    parser_classes = PARSER_CLASSES
+
+    @method_decorator(condition(etag_func=detail_etag, last_modified_func=detail_last_modified))
     def get(self, request, model, pk, format=None):
-        Model, Serializer, _import_order = ModelSwitch.classes(model)
+        Model = ModelSwitch.classes(model)[0]
         if Model is None:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            row = Model.objects.get(pk=pk)
-        except Model.DoesNotExist:
+        if expand(request, Model):
+            with metrics.phase('serialize'):
+                documents = product_documents(pks=[pk])
+            if not documents:
+                raise Http404
+            return Response(documents[0])
+
+        stamp = detail_version(request, model, pk)   # loaded for the ETag already, with the cache entry
+        if request.detail_entry is not None:
+            return Response(request.detail_entry[1])
+        with metrics.phase('serialize'):
+            data = get_reader(Model).rows([pk]).get(pk)   # see readers.py, the same as Serializer(row).data
+        if data is None:
             raise Http404
             # return Response(status=status.HTTP_404_NOT_FOUND)
-
-        serializer = Serializer(row)
-        return Response(serializer.data)
-
-
-class ModelSwitch:
-    @staticmethod
-    def classes(model):
-        return MODELSWITCH.get(model.lower(), (None, None))
+        set_rows(Model._meta.model_name, {pk: stamp}, {pk: data})
+        return Response(data)
+
+
+def json_list(values, chunk_size=LIST_CHUNK_SIZE):
+    """JSON list of numbers, generated by parts (for StreamingHttpResponse)"""
+    yield '['
+    chunk = []
+    separator = ''
+    for value in values:
+        chunk.append(str(value))
+        if len(chunk) == chunk_size:
+            yield separator + ','.join(chunk)
+            separator = ','
+            chunk = []
+    if chunk:
+        yield separator + ','.join(chunk)
+    yield ']'
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'product_api.metrics.MetricsMiddleware',   # first: the whole request is measured
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,10 +79,26 @@ WSGI_APPLICATION = 'ukol_zvolsky.wsgi.application'
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
 DATABASES = {
-    'default': {
+    'default': {   # primary: all writes, reads of imports (see product_api/db.py)
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'CONN_MAX_AGE': 600,   # persistent connections (seconds), not a new connection for each request
+    },
+    'replica': {   # reads of the API views; for SQLite the same file (WAL: readers aren't blocked by writers)
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['product_api.db.PrimaryReplicaRouter']
+DATABASE_READ_ALIAS = 'replica'   # None: reads from 'default' too
+
+# applied to each new SQLite connection (product_api/db.py)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',     # readers don't wait for the writer (and the writer doesn't wait for readers)
+    'synchronous': 'normal',   # with WAL: fsync at checkpoints only, a power loss can lose the last commits, not corrupt the db
+    'cache_size': -64000,      # page cache of each connection, KiB (negative) = 64 MB
 }
 
 
@@ -129,3 +147,26 @@ REST_FRAMEWORK = {
         #'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ]
 }
+
+# Metrics of requests and imports (product_api/metrics.py), GET /metrics in the Prometheus text format
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']   # the endpoint gives 404 to other addresses
+
+# Imports with FAILURE_RESUME mode (product_api/importer.py) commit after each chunk of items of a model
+IMPORT_COMMIT_CHUNK = 2000
+
+# Background imports (POST /import?async=1)
+IMPORT_JOB_WORKERS = 1   # threads of each process (SQLite has a single writer); 0: no background, the import runs in the request
+IMPORT_JOB_DIR = os.path.join(tempfile.gettempdir(), 'ukol_zvolsky_import_jobs')   # stored payloads
+
+# Dry run of imports (POST /import?dry_run=1)
+IMPORT_VALIDATION_WORKERS = min(4, os.cpu_count() or 1)   # processes validating large payloads; 1: validate in the request process
+
+# Cache of /detail/<model>/<pk> responses, see product_api/cache.py
+DETAIL_CACHE = {
+    'BACKEND': 'product_api.cache.LRUCache',   # None: no cache
+    'OPTIONS': {
+        'max_size': 10000,   # entries
+        'ttl': 3600,         # seconds
+        'verify': True,      # check the row's stamp (1 query), other processes can change the rows; see product_api/cache.py
+    },
+}